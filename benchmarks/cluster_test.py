@@ -0,0 +1,161 @@
+"""Run several bot processes in CLUSTER_MODE and check they coordinate.
+
+Starts the fake Bot API from fake_telegram.py and N `bot.py` processes that
+share one MongoDB database, then checks that:
+
+* exactly one process polls: every update gets exactly one reply
+  (two pollers reading the same offset would answer twice),
+* killing the lease holder hands polling to another process within
+  a couple of lease periods,
+* quiz deliveries queued as jobs are sent exactly once, including the ones
+  that were running on the killed process.
+
+Needs a real MongoDB (mongomock can't be shared between processes):
+
+    MONGODB_URI=mongodb://localhost:27017 python benchmarks/cluster_test.py --workers 3
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram, command_update, document_update  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = '123456:TEST-TOKEN'
+DB_NAME = 'quiz_bot_cluster_test'
+LEASE_TTL = 6
+QUESTIONS = 20
+USER_ID_BASE = 700000
+
+QUIZ_BLOCK = (
+    "Question {n}: which option is correct?\n"
+    "A) First option\nB) Second option\nC) Third option\nD) Fourth option\n"
+    "Answer: {answer}\n"
+)
+
+
+def spawn_worker(index: int, fake: FakeTelegram, mongodb_uri: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN=TOKEN,
+        TELEGRAM_API_URL=fake.base_url,
+        TELEGRAM_FILE_URL=fake.base_file_url,
+        MONGODB_URI=mongodb_uri,
+        DB_NAME=DB_NAME,
+        CLUSTER_MODE='1',
+        WORKER_ID=f'worker-{index}',
+        LEASE_TTL=str(LEASE_TTL),
+        PORT=str(18080 + index),
+    )
+    env.pop('WEBHOOK_URL', None)
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, 'bot.py')], env=env)
+
+
+async def wait_until(predicate, timeout: float, what: str) -> float:
+    started = time.monotonic()
+    while not predicate():
+        if time.monotonic() - started > timeout:
+            raise AssertionError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.1)
+    return time.monotonic() - started
+
+
+def replies_by_chat(fake: FakeTelegram, method: str) -> Counter:
+    return Counter(params.get('chat_id') for _, params in fake.requests[method])
+
+
+async def run(workers: int, updates: int, mongodb_uri: str) -> None:
+    mongo = MongoClient(mongodb_uri)
+    mongo.drop_database(DB_NAME)
+    db = mongo[DB_NAME]
+
+    fake = FakeTelegram()
+    await fake.start()
+    procs = {f'worker-{i}': spawn_worker(i, fake, mongodb_uri) for i in range(workers)}
+    update_ids = iter(range(1, 1_000_000))
+    try:
+        await wait_until(lambda: db.leases.find_one({'_id': 'poller'}), 30, "a poller to be elected")
+        leader = db.leases.find_one({'_id': 'poller'})['holder']
+        print(f"{workers} workers started, {leader} holds the polling lease")
+
+        # 1. One reply per update while all workers are alive
+        for i in range(updates):
+            fake.push_update(command_update(next(update_ids), USER_ID_BASE + i, '/start'))
+        await wait_until(lambda: fake.calls['sendMessage'] >= updates, 60, "replies to /start")
+        await asyncio.sleep(LEASE_TTL / 2)
+        duplicates = [chat for chat, n in replies_by_chat(fake, 'sendMessage').items() if n > 1]
+        assert not duplicates, f"{len(duplicates)} chats were answered more than once"
+        print(f"ok: {updates} updates answered exactly once")
+
+        # 2. Quiz deliveries are spread over the queue; kill the leader mid-way
+        quiz = '\n'.join(QUIZ_BLOCK.format(n=n, answer=n % 4 + 1) for n in range(QUESTIONS)).encode()
+        quiz_users = [USER_ID_BASE + updates + i for i in range(updates)]
+        for n, user_id in enumerate(quiz_users):
+            file_id = f'quiz-{n}'
+            fake.add_file(file_id, quiz)
+            fake.push_update(document_update(next(update_ids), user_id, file_id))
+        await wait_until(lambda: db.jobs.count_documents({}) >= len(quiz_users) // 2, 60, "quiz jobs")
+
+        procs[leader].send_signal(signal.SIGKILL)
+        procs[leader].wait()
+        killed_at = time.monotonic()
+        print(f"killed {leader}")
+
+        # 3. Another worker takes over polling
+        await wait_until(
+            lambda: (db.leases.find_one({'_id': 'poller'}) or {}).get('holder') not in (None, leader),
+            LEASE_TTL * 3, "a new poller"
+        )
+        new_leader = db.leases.find_one({'_id': 'poller'})['holder']
+        probe_chat = USER_ID_BASE + 3 * updates
+        fake.push_update(command_update(next(update_ids), probe_chat, '/start'))
+        await wait_until(lambda: replies_by_chat(fake, 'sendMessage')[probe_chat], LEASE_TTL * 3, "failover reply")
+        print(f"ok: {new_leader} took over polling {time.monotonic() - killed_at:.1f}s after the kill")
+
+        # 4. Every quiz job finishes, including those reclaimed from the killed worker
+        await wait_until(
+            lambda: db.jobs.count_documents({'kind': 'quiz_delivery', 'status': 'done'}) >= len(quiz_users),
+            120, "all quiz jobs to finish"
+        )
+        polls = replies_by_chat(fake, 'sendPoll')
+        short = [user for user in quiz_users if polls[user] < QUESTIONS]
+        assert not short, f"{len(short)} quizzes were not fully delivered"
+        resent = sum(polls[user] - QUESTIONS for user in quiz_users)
+        reclaimed = db.jobs.count_documents({'attempts': {'$gt': 1}})
+        # A job running on the killed worker resumes from its last checkpoint,
+        # so only reclaimed jobs may repeat polls, and only those sent since then
+        print(f"ok: {len(quiz_users)} quizzes delivered; {reclaimed} jobs reclaimed, {resent} polls repeated")
+        assert reclaimed or not resent, "polls repeated without any job being reclaimed"
+    finally:
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in procs.values():
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        await fake.stop()
+        mongo.drop_database(DB_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--updates', type=int, default=50)
+    parser.add_argument('--mongodb-uri', default=os.getenv('MONGODB_URI', 'mongodb://localhost:27017'))
+    args = parser.parse_args()
+    asyncio.run(run(args.workers, args.updates, args.mongodb_uri))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Measure time to the first answered update after a cold start.
+
+Runs the real Application in polling mode against the fake Bot API from
+fake_telegram.py, with mongomock behind a fixed per-operation delay
+standing in for a remote MongoDB. A /start update is queued before the bot
+starts; the clock runs from build_application until the reply arrives.
+
+  eager - index builds, stats seeding and the premium load finish before
+          the bot starts (the old startup sequence)
+  lazy  - the current startup: all of that runs in the background
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/cold_start.py --latency-ms 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram, command_update  # noqa: E402
+from support import bot, use_mongomock  # noqa: E402
+
+TOKEN = '123456:TEST-TOKEN'
+
+
+class SlowCollection:
+    """Delay every call on a collection by `latency` seconds, like a remote server"""
+
+    def __init__(self, collection, latency: float):
+        self._collection = collection
+        self._latency = latency
+        self.name = collection.name
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._latency)
+            return attr(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+
+def use_slow_mongo(latency: float) -> None:
+    import mongomock
+
+    use_mongomock()
+    for name, value in list(vars(bot).items()):
+        if isinstance(value, mongomock.Collection):
+            setattr(bot, name, SlowCollection(value, latency))
+    bot.parsed_quiz_cache = bot.ParsedQuizCache(
+        bot.quiz_cache, bot.QUIZ_MEMORY_CACHE_SIZE, bot.QUIZ_CACHE_MAX_BYTES
+    )
+    # Pretend an existing deployment: seeding finds totals, no rescan needed
+    bot.stats.insert_one({'_id': 'seeded', 'new_users': 0})
+
+
+async def cold_start(mode: str) -> dict:
+    bot.startup = bot.StartupTimer()
+    bot.premium_expiry = bot.PremiumExpiryScheduler()
+    fake = FakeTelegram()
+    await fake.start()
+    fake.push_update(command_update(1, 424242, '/start'))
+
+    started = time.perf_counter()
+    if mode == 'eager':
+        bot.ensure_indexes()
+        bot.seed_stats()
+        await bot.premium_expiry.load()
+    application = bot.build_application(TOKEN, fake.base_url, fake.base_file_url)
+    bot.startup.mark('build_application')
+    stop_event = asyncio.Event()
+    runner = asyncio.create_task(bot.run_bot(application, stop_event=stop_event))
+    await fake.wait_for('sendMessage', timeout=60)
+    first_reply = time.perf_counter() - started
+
+    stop_event.set()
+    await runner
+    await fake.stop()
+    return {'first_reply_ms': first_reply * 1000, 'phases': dict(bot.startup.phases)}
+
+
+async def run(latency: float) -> None:
+    logging.getLogger().setLevel(logging.WARNING)
+    use_slow_mongo(latency)
+    print(f"{latency * 1000:.0f} ms per Mongo operation")
+    for mode in ('eager', 'lazy'):
+        result = await cold_start(mode)
+        phases = ', '.join(f"{name} {seconds * 1000:.0f}" for name, seconds in result['phases'].items())
+        print(f"{mode:>6}: first reply after {result['first_reply_ms']:7.1f} ms   [{phases}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.latency_ms / 1000))
+
+
+if __name__ == '__main__':
+    main()
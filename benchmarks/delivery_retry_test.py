@@ -0,0 +1,134 @@
+"""Check that retried quiz deliveries never resend or drop polls.
+
+Runs quiz_delivery jobs through the real JobWorker against a fake bot, with
+mongomock standing in for MongoDB, and retries each job the way the worker
+loop does until it is done or given up. Every scenario must end with the
+job done and each question's poll sent exactly once (a poll that Telegram
+refused is skipped with a notice, never retried):
+
+* edit_timeout: every progress edit raises TimedOut,
+* flaky_sends: progress edits raise NetworkError, every 7th send_poll
+  raises TimedOut and the "Failed to send one quiz" notice raises Forbidden,
+* crash: delivery raises an unexpected error twice mid-quiz, so the job
+  is retried from its checkpoint.
+
+    python benchmarks/delivery_retry_test.py --questions 60
+"""
+import argparse
+import asyncio
+import os
+import sys
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import bot, use_mongomock  # noqa: E402
+from telegram.error import Forbidden, NetworkError, TimedOut  # noqa: E402
+
+CHAT_ID = 4242
+
+
+class FakeBot:
+    def __init__(self, edit_error=None, poll_error_every: int = 0, notice_error=None):
+        self.edit_error = edit_error
+        self.poll_error_every = poll_error_every
+        self.notice_error = notice_error
+        self.poll_calls = 0
+        self.polls = []  # question texts, in send order
+        self.refused = []
+
+    async def send_poll(self, **params):
+        self.poll_calls += 1
+        if self.poll_error_every and self.poll_calls % self.poll_error_every == 0:
+            self.refused.append(params['question'])
+            raise TimedOut()
+        self.polls.append(params['question'])
+        return SimpleNamespace(poll=SimpleNamespace(id=f'poll-{self.poll_calls}'))
+
+    async def send_message(self, **params):
+        if self.notice_error and 'Failed to send' in params['text']:
+            raise self.notice_error
+
+    async def edit_message_text(self, **params):
+        if self.edit_error:
+            raise self.edit_error
+
+
+def fail_deliveries(positions: set):
+    """Make send_quiz_poll raise once, before sending, at each of these question numbers"""
+    send_quiz_poll = bot.send_quiz_poll
+    calls = Counter()
+
+    async def failing(fake, chat_id, question):
+        calls[question[0]] += 1
+        number = int(question[0].split()[1])
+        if number in positions and calls[question[0]] == 1:
+            raise RuntimeError(f"injected failure at question {number}")
+        return await send_quiz_poll(fake, chat_id, question)
+    bot.send_quiz_poll = failing
+    return send_quiz_poll
+
+
+async def run_scenario(name: str, fake: FakeBot, questions: int, fail_at: set = ()) -> dict:
+    bot.jobs.delete_many({})
+    quiz = [(f"Question {n} of {questions}?", ['A', 'B', 'C'], n % 3, None) for n in range(1, questions + 1)]
+    status = SimpleNamespace(message_id=1, text="📝 Quiz queued")
+    job_id = await bot.enqueue_quiz_delivery(CHAT_ID, CHAT_ID, quiz, status)
+    original = fail_deliveries(set(fail_at)) if fail_at else None
+    worker = bot.JobWorker(fake)
+    attempts = 0
+    try:
+        while True:
+            job = await bot.run_db(bot._claim_job, worker.worker_id)
+            if job is None:
+                break
+            attempts += 1
+            await worker._run_job(job)
+    finally:
+        if original:
+            bot.send_quiz_poll = original
+    job = bot.jobs.find_one({'_id': job_id})
+    sent = Counter(fake.polls)
+    expected = [question[0] for question in quiz]
+    resent = sorted(text for text, count in sent.items() if count > 1)
+    dropped = [text for text in expected if text not in sent and text not in fake.refused]
+    return {
+        'name': name, 'status': job['status'], 'attempts': attempts,
+        'polls': len(fake.polls), 'refused': len(fake.refused),
+        'resent': len(resent), 'dropped': len(dropped),
+        'ok': job['status'] == 'done' and not resent and not dropped,
+    }
+
+
+async def run(args) -> list:
+    use_mongomock()
+    return [
+        await run_scenario('edit_timeout', FakeBot(edit_error=TimedOut()), args.questions),
+        await run_scenario(
+            'flaky_sends',
+            FakeBot(edit_error=NetworkError('reset'), poll_error_every=7, notice_error=Forbidden('blocked')),
+            args.questions
+        ),
+        await run_scenario('crash', FakeBot(), args.questions,
+                           fail_at={args.questions // 3, args.questions * 2 // 3}),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=60)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    for row in results:
+        print(f"{row['name']:<13} {row['status']:<7} attempts {row['attempts']}   polls {row['polls']:>4}   "
+              f"refused {row['refused']:>3}   resent {row['resent']:>3}   dropped {row['dropped']:>3}   "
+              f"{'ok' if row['ok'] else 'FAIL'}")
+    failed = not all(row['ok'] for row in results)
+    print('FAIL' if failed else 'OK')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Measure event-loop stall caused by MongoDB calls made from handlers.
+
+Simulates N concurrent users each running the lookups a typical command
+performs (premium check, user upsert, quota update) against a fake
+collection with fixed per-operation latency, and compares calling pymongo
+directly on the loop with going through bot.run_db.
+
+    python benchmarks/event_loop_stall.py --users 200 --latency-ms 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+class SlowCollection:
+    """Stand-in for a pymongo collection where every call blocks for `latency` seconds"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def find_one(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return None
+
+    def find_one_and_update(self, filter, *args, **kwargs):
+        time.sleep(self.latency)
+        return {'user_id': filter.get('user_id'), 'quiz_count': 0, 'last_quiz_time': 0}
+
+    def update_one(self, *args, **kwargs):
+        time.sleep(self.latency)
+
+
+async def blocking_user(user_id: int):
+    # What the handlers did before: pymongo called straight from the coroutine
+    bot.premium_subscriptions.find_one({'user_id': user_id})
+    bot.users.find_one_and_update({'user_id': user_id}, {})
+    bot.users.update_one({'user_id': user_id}, {})
+
+
+async def offloaded_user(user_id: int):
+    await bot.is_premium(user_id)
+    await bot.run_db(bot.users.find_one_and_update, {'user_id': user_id}, {})
+    await bot.update_user_data(user_id, {'last_quiz_time': time.time()})
+
+
+async def measure(user_coro, n_users: int, interval: float = 0.001) -> dict:
+    stalls = []
+    running = True
+
+    async def monitor():
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            stalls.append(max(0.0, time.perf_counter() - started - interval))
+
+    monitor_task = asyncio.create_task(monitor())
+    await asyncio.sleep(interval)
+    started = time.perf_counter()
+    await asyncio.gather(*(user_coro(uid) for uid in range(n_users)))
+    elapsed = time.perf_counter() - started
+    running = False
+    await monitor_task
+
+    return {
+        'wall_s': elapsed,
+        'max_stall_ms': max(stalls, default=0.0) * 1000,
+        'total_stall_ms': sum(stalls) * 1000,
+    }
+
+
+async def run(n_users: int, latency: float):
+    bot.users = SlowCollection(latency)
+    bot.premium_subscriptions = SlowCollection(latency)
+
+    print(f"{n_users} users, {latency * 1000:.1f} ms per Mongo op, pool size {bot.DB_POOL_SIZE}")
+    for name, user_coro in (('blocking', blocking_user), ('run_db', offloaded_user)):
+        result = await measure(user_coro, n_users)
+        print(
+            f"{name:>9}: wall {result['wall_s'] * 1000:8.1f} ms | "
+            f"max stall {result['max_stall_ms']:8.1f} ms | "
+            f"total stall {result['total_stall_ms']:8.1f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.latency_ms / 1000))
+
+
+if __name__ == '__main__':
+    main()
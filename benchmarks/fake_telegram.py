@@ -0,0 +1,288 @@
+"""A local stand-in for the Telegram Bot API.
+
+Answers the Bot API methods the quiz bot uses with well-formed results and
+records every call, so the real Application can be exercised end to end
+without touching api.telegram.org:
+
+    fake = FakeTelegram()
+    await fake.start('127.0.0.1', 8081)
+    application = bot.build_application(TOKEN, fake.base_url, fake.base_file_url)
+
+It can also behave like a loaded server: `latency` (plus up to `jitter`)
+delays every API call and file download, and `flood_ratio` of the send
+calls fail with 429 Too Many Requests and a `retry_after` of that many
+seconds, the way Telegram answers bots that exceed its limits.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'Quiz Bot', 'username': 'quiz_test_bot'}
+SEND_METHODS = frozenset({'sendMessage', 'sendPoll', 'editMessageText', 'sendDocument'})
+
+
+def _decode_value(value: str):
+    # PTB sends form fields whose non-string values are JSON encoded
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_ratio: float = 0.0,
+                 retry_after: int = 1, seed: int = None):
+        self.server = None
+        self.host = None
+        self.port = None
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_ratio = flood_ratio
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self.calls = Counter()
+        self.chat_calls = Counter()  # (method, chat_id) -> successful calls
+        self.flooded = Counter()  # method -> calls answered with 429
+        self.requests = defaultdict(list)  # method -> [(timestamp, params)]
+        self.files = {}  # file_id -> bytes
+        self.webhook = None
+        self.updates = []  # pending updates served by getUpdates
+        self._updates_changed = asyncio.Event()
+        self._connections = set()
+        self._message_ids = itertools.count(1)
+        self._waiters = defaultdict(list)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self) -> None:
+        self.server.close()
+        # Long polls may still be held open by getUpdates
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def add_file(self, file_id: str, data: bytes) -> None:
+        self.files[file_id] = data
+
+    def push_update(self, update: dict) -> None:
+        """Queue an update for the next getUpdates call"""
+        self.updates.append(update)
+        self._updates_changed.set()
+
+    async def get_updates(self, params: dict) -> list:
+        # Like the real API: `offset` confirms everything below it, and an
+        # empty queue is held open for up to `timeout` seconds
+        offset = params.get('offset') or 0
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        deadline = time.monotonic() + min(params.get('timeout') or 0, 5)
+        while not self.updates and time.monotonic() < deadline:
+            self._updates_changed.clear()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+        return self.updates[:params.get('limit') or 100]
+
+    async def wait_for(self, method: str, count: int = 1, timeout: float = 10, chat_id: int = None) -> None:
+        """Wait until `method` has been called at least `count` times (for `chat_id`, if given)"""
+        key = method if chat_id is None else (method, chat_id)
+        counter = self.calls if chat_id is None else self.chat_calls
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while counter[key] < count:
+            future = loop.create_future()
+            self._waiters[key].append(future)
+            await asyncio.wait_for(future, deadline - loop.time())
+
+    def _record(self, method: str, params: dict) -> None:
+        self.calls[method] += 1
+        self.requests[method].append((time.perf_counter(), params))
+        keys = [method]
+        if 'chat_id' in params:
+            self.chat_calls[method, params['chat_id']] += 1
+            keys.append((method, params['chat_id']))
+        for key in keys:
+            for future in self._waiters.pop(key, []):
+                if not future.done():
+                    future.set_result(None)
+
+    async def _delay(self) -> None:
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+    def _flood(self, method: str):
+        """Return a 429 response for `flood_ratio` of the send calls, else None"""
+        if method not in SEND_METHODS or self._random.random() >= self.flood_ratio:
+            return None
+        self.flooded[method] += 1
+        payload = {
+            'ok': False, 'error_code': 429,
+            'description': f"Too Many Requests: retry after {self.retry_after}",
+            'parameters': {'retry_after': self.retry_after},
+        }
+        return 429, json.dumps(payload).encode(), 'application/json'
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = params.get('chat_id', 0)
+        chat_type = 'private' if isinstance(chat_id, int) and chat_id > 0 else 'supergroup'
+        return {
+            'message_id': params.get('message_id') or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': chat_type},
+            'from': BOT_USER,
+            **extra,
+        }
+
+    async def call(self, method: str, params: dict):
+        """Return the result of a Bot API method, or (status, error payload) to fail it"""
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook = params
+            return True
+        if method == 'deleteWebhook':
+            self.webhook = None
+            return True
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendPoll':
+            options = [{'text': text, 'voter_count': 0} for text in params.get('options', [])]
+            poll = {
+                'id': str(next(self._message_ids)), 'question': params.get('question', ''),
+                'options': options, 'total_voter_count': 0, 'is_closed': False,
+                'is_anonymous': params.get('is_anonymous', True), 'type': params.get('type', 'regular'),
+                'allows_multiple_answers': False, 'correct_option_id': params.get('correct_option_id'),
+            }
+            return self._message(params, poll=poll)
+        if method == 'getFile':
+            file_id = params['file_id']
+            return {
+                'file_id': file_id, 'file_unique_id': file_id,
+                'file_size': len(self.files.get(file_id, b'')), 'file_path': f"documents/{file_id}",
+            }
+        if method in ('answerCallbackQuery', 'deleteMessage', 'setMyCommands'):
+            return True
+        raise LookupError(method)
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def _respond(self, target: str, headers: dict, body: bytes) -> tuple:
+        path = target.split('?', 1)[0]
+        await self._delay()
+        if path.startswith('/file/bot'):
+            file_id = path.rsplit('/', 1)[-1]
+            if file_id not in self.files:
+                return 404, b'', 'text/plain'
+            return 200, self.files[file_id], 'application/octet-stream'
+
+        method = path.rsplit('/', 1)[-1]
+        content_type = headers.get('content-type', '')
+        if content_type.startswith('application/json'):
+            params = json.loads(body or b'{}')
+        else:
+            params = {k: _decode_value(v) for k, v in parse_qsl(body.decode('utf-8'))}
+        if '?' in target:
+            params.update({k: _decode_value(v) for k, v in parse_qsl(target.split('?', 1)[1])})
+
+        flooded = self._flood(method)
+        if flooded:
+            return flooded
+        self._record(method, params)
+        try:
+            result = await self.call(method, params)
+        except LookupError:
+            payload = {'ok': False, 'error_code': 404, 'description': f"Not Found: method {method}"}
+            return 404, json.dumps(payload).encode(), 'application/json'
+        if isinstance(result, tuple):
+            # (status, error payload) from subclasses injecting failures
+            status, payload = result
+            return status, json.dumps(payload).encode(), 'application/json'
+        return 200, json.dumps({'ok': True, 'result': result}).encode(), 'application/json'
+
+    async def _handle_connection(self, reader, writer) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                _, target, headers, body = request
+                status, payload, content_type = await self._respond(target, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+def command_update(update_id: int, user_id: int, text: str) -> dict:
+    """Build a private-chat message update carrying a bot command"""
+    command = text.split()[0]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        },
+    }
+
+
+def document_update(update_id: int, user_id: int, file_id: str, file_name: str = 'quiz.txt') -> dict:
+    """Build a private-chat message update carrying an uploaded document"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'document': {
+                'file_id': file_id, 'file_unique_id': file_id,
+                'file_name': file_name, 'mime_type': 'text/plain',
+            },
+        },
+    }
@@ -0,0 +1,338 @@
+"""Benchmark suite for the parsing and handler hot paths.
+
+Covers:
+  parse     - parse_quiz_file on synthetic files of 10 to 100k questions,
+              clean and with a mix of malformed blocks, and the JSON importer
+              on a minified single-line array of the same sizes
+  handlers  - end-to-end latency of start, create_quiz and handle_document
+              against mongomock and a fake Bot
+  memory    - tracemalloc high-water marks for the above
+
+Results are written as JSON so runs can be compared between releases:
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/hot_paths.py --output bench.json
+    python benchmarks/hot_paths.py --quick
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import bot, use_mongomock  # noqa: E402
+
+GOOD_BLOCK = (
+    "Question {n}: which option is correct?\n"
+    "A) First option\n"
+    "B) Second option\n"
+    "C) Third option\n"
+    "D) Fourth option\n"
+    "Answer: {answer}\n"
+    "Explanation for question {n}\n"
+)
+BAD_BLOCKS = (
+    "Question {n} without enough lines\nA) one\nB) two\n",
+    "Question {n} missing answer\nA) 1\nB) 2\nC) 3\nD) 4\nSolution: 2\n",
+    "Question {n} bad answer\nA) 1\nB) 2\nC) 3\nD) 4\nAnswer: 9\n",
+    "Question {n} malformed answer\nA) 1\nB) 2\nC) 3\nD) 4\nAnswer: two\n",
+)
+
+
+def make_quiz(questions: int, malformed_ratio: float = 0.0, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    blocks = []
+    for n in range(questions):
+        if rng.random() < malformed_ratio:
+            blocks.append(rng.choice(BAD_BLOCKS).format(n=n))
+        else:
+            blocks.append(GOOD_BLOCK.format(n=n, answer=n % 4 + 1))
+    return '\n'.join(blocks)
+
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def traced(func):
+    """Run func() and return (result, peak traced MB)"""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2**20
+
+
+def bench_parse(sizes: list, repeat: int) -> list:
+    results = []
+    for questions in sizes:
+        for malformed_ratio in (0.0, 0.2):
+            content = make_quiz(questions, malformed_ratio)
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                valid_questions, errors = bot.parse_quiz_file(content)
+                samples.append(time.perf_counter() - started)
+            _, peak_mb = traced(lambda: bot.parse_quiz_file(content))
+            results.append({
+                'name': 'parse_quiz_file',
+                'questions': questions,
+                'malformed_ratio': malformed_ratio,
+                'input_bytes': len(content.encode('utf-8')),
+                'valid': len(valid_questions),
+                'errors': len(errors),
+                'questions_per_s': questions / statistics.fmean(samples),
+                'peak_mb': peak_mb,
+                **summarize(samples),
+            })
+    return results
+
+
+def make_json_quiz(questions: int) -> bytes:
+    items = [
+        {'question': f'Question {n}: which option is correct?',
+         'options': ['First option', 'Second option', 'Third option', 'Fourth option'],
+         'answer': n % 4 + 1}
+        for n in range(questions)
+    ]
+    return json.dumps(items, separators=(',', ':')).encode('utf-8')
+
+
+def bench_parse_json(sizes: list, repeat: int) -> list:
+    importer = bot.find_importer('quiz.json')
+    results = []
+    for questions in sizes:
+        data = make_json_quiz(questions)
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            valid_questions, errors = bot.parse_quiz_bytes(data, importer)
+            samples.append(time.perf_counter() - started)
+        _, peak_mb = traced(lambda: bot.parse_quiz_bytes(data, importer))
+        results.append({
+            'name': 'parse_quiz_bytes[minified json]',
+            'questions': questions,
+            'input_bytes': len(data),
+            'valid': len(valid_questions),
+            'errors': len(errors),
+            'questions_per_s': questions / statistics.fmean(samples),
+            'peak_mb': peak_mb,
+            **summarize(samples),
+        })
+    return results
+
+
+# Fakes for the handler benchmarks
+
+class FakeFile:
+    def __init__(self, data: bytes, latency: float):
+        self.data = data
+        self.latency = latency
+
+    async def download_as_bytearray(self):
+        await asyncio.sleep(self.latency)
+        return bytearray(self.data)
+
+
+class FakeBot:
+    """Implements the Bot methods the handlers call, with fixed latency"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.files = {}
+        self.calls = 0
+
+    async def _call(self, result=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return result
+
+    async def get_file(self, file_id):
+        await self._call()
+        return FakeFile(self.files[file_id], self.latency)
+
+    async def send_poll(self, **kwargs):
+        return await self._call(SimpleNamespace(poll=SimpleNamespace(id=f'poll-{self.calls}')))
+
+    async def send_message(self, **kwargs):
+        return await self._call()
+
+    async def edit_message_text(self, **kwargs):
+        return await self._call()
+
+
+def make_update(fake_bot, user_id: int, document=None):
+    async def reply_text(*args, **kwargs):
+        return await fake_bot._call()
+
+    message = SimpleNamespace(reply_text=reply_text, document=document, chat_id=user_id)
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id, type='private'),
+        message=message,
+    )
+
+
+def make_context(fake_bot, args=None):
+    return SimpleNamespace(bot=fake_bot, args=args or [], user_data={}, chat_data={}, bot_data={})
+
+
+def mongo_operation_count() -> int:
+    return sum(series['count'] for series in bot.MONGO_SECONDS._values.values())
+
+
+async def bench_handlers(runs: int, latency: float, questions: int) -> list:
+    fake_bot = FakeBot(latency)
+    quiz = make_quiz(questions).encode('utf-8')
+    # Premium users are not capped by the free-tier quota, so every upload sends all polls
+    await bot.add_premium_subscription(1, '30 days')
+
+    async def start(i):
+        await bot.start(make_update(fake_bot, 1000 + i), make_context(fake_bot))
+
+    async def create_quiz(i):
+        await bot.create_quiz(make_update(fake_bot, 2000 + i), make_context(fake_bot))
+
+    def upload(file_unique_id):
+        fake_bot.files[file_unique_id] = quiz
+        return SimpleNamespace(
+            file_name='quiz.txt', mime_type='text/plain', file_id=file_unique_id, file_unique_id=file_unique_id
+        )
+
+    async def handle_document_miss(i):
+        document = upload(f'miss-{i}-{random.random()}')
+        await bot.handle_document(make_update(fake_bot, 1, document), make_context(fake_bot))
+
+    async def handle_document_hit(i):
+        document = upload('shared-file')
+        await bot.handle_document(make_update(fake_bot, 1, document), make_context(fake_bot))
+
+    # A board with 10k players for the answer and leaderboard paths
+    for board_id in (-1, bot.GLOBAL_BOARD):
+        board = bot.scoreboard.boards.setdefault(board_id, bot.RankedScores())
+        for user_id in range(10000):
+            board.set(10 ** 6 + user_id, user_id % 7)
+            board.answered[10 ** 6 + user_id] = 7
+    for user_id in range(10000):
+        bot.scoreboard.names[10 ** 6 + user_id] = f'Player {user_id}'
+
+    async def poll_answer(i):
+        bot.poll_registry.add(f'bench-{i}', -1, 0)
+        user = SimpleNamespace(id=10 ** 6 + i % 10000, username=None, first_name='Player')
+        update = SimpleNamespace(poll_answer=SimpleNamespace(poll_id=f'bench-{i}', option_ids=[i % 4], user=user))
+        await bot.poll_answer_handler(update, make_context(fake_bot))
+
+    async def leaderboard(i):
+        await bot.leaderboard_command(make_update(fake_bot, 3000 + i), make_context(fake_bot))
+
+    async def myscore(i):
+        await bot.myscore_command(make_update(fake_bot, 10 ** 6 + i), make_context(fake_bot))
+
+    results = []
+    for name, handler in (
+        ('start', start),
+        ('create_quiz', create_quiz),
+        ('handle_document[cache miss]', handle_document_miss),
+        ('handle_document[cache hit]', handle_document_hit),
+        ('poll_answer', poll_answer),
+        ('leaderboard', leaderboard),
+        ('myscore', myscore),
+    ):
+        await handler(-1)  # warm up
+        samples = []
+        calls_before = fake_bot.calls
+        await bot.user_writes.flush()
+        ops_before = mongo_operation_count()
+        tracemalloc.start()
+        for i in range(runs):
+            started = time.perf_counter()
+            await handler(i)
+            samples.append(time.perf_counter() - started)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Buffered writes count against the handler that produced them
+        await bot.user_writes.flush()
+        await bot.poll_registry.flush()
+        await bot.scoreboard.flush()
+        mongo_ops = mongo_operation_count() - ops_before
+        results.append({
+            'name': name,
+            'bot_latency_ms': latency * 1000,
+            'questions': questions if name.startswith('handle_document') else 0,
+            'bot_calls_per_run': (fake_bot.calls - calls_before) / runs,
+            'mongo_ops_per_run': mongo_ops / runs,
+            'peak_mb': peak / 2**20,
+            **summarize(samples),
+        })
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes for a fast smoke run')
+    parser.add_argument('--bot-latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.quick:
+        sizes, repeat, runs = [10, 1000, 10000], 3, 20
+    else:
+        sizes, repeat, runs = [10, 100, 1000, 10000, 100000], 5, 100
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'parse': bench_parse(sizes, repeat) + bench_parse_json(sizes, repeat),
+    }
+
+    use_mongomock()
+    report['handlers'] = asyncio.run(bench_handlers(runs, args.bot_latency_ms / 1000, questions=50))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        for section in ('parse', 'handlers'):
+            for row in report[section]:
+                malformed = f"{row['malformed_ratio']:.0%} bad" if 'malformed_ratio' in row else ''
+                print(f"{row['name']:<30} {row['questions']:>7} {malformed:>7}  p50 {row['p50_ms']:9.3f} ms  "
+                      f"peak {row['peak_mb']:7.2f} MB")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
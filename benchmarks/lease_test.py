@@ -0,0 +1,181 @@
+"""Check the polling lease in one process, with mongomock standing in for MongoDB.
+
+The single-process counterpart of cluster_test.py: several lease holders run
+as asyncio tasks and renew the lease like poll_updates does (every TTL/3),
+while a monitor samples who believes it is the leader. Each round stops the
+current leader in one of three ways and checks that:
+
+* no two holders ever hold a live lease at the same time,
+* exactly one holder leads whenever the lease isn't in a takeover gap,
+* another holder takes over within TTL + TTL/3 after a crash (the lease
+  has to expire) or within TTL/3 after a clean release,
+* a leader that stalls past its TTL steps down once it notices.
+
+The holders call the lease functions on the event loop rather than through
+run_db: mongomock's find_one_and_update isn't atomic across threads, while
+MongoDB serialises writes to the lease document itself.
+
+    python benchmarks/lease_test.py --holders 5 --rounds 6 --ttl 0.6
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import bot, use_mongomock  # noqa: E402
+
+LEASE = 'poller'
+SLACK = 0.25  # seconds of scheduling noise allowed on top of the expected takeover time
+
+
+class Holder:
+    def __init__(self, holder_id: str, ttl: float):
+        self.holder_id = holder_id
+        self.ttl = ttl
+        self.leader = False
+        self.renewed_at = 0.0
+        self.stalled = False
+        self.task = None
+
+    def live(self, now: float) -> bool:
+        """Whether this holder leads under a lease that hasn't expired yet"""
+        return self.leader and now < self.renewed_at + self.ttl
+
+    async def run(self) -> None:
+        try:
+            while True:
+                if not self.stalled:
+                    renewed_at = time.monotonic()
+                    self.leader = bot._acquire_lease(LEASE, self.holder_id, self.ttl)
+                    if self.leader:
+                        self.renewed_at = renewed_at
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            self.leader = False
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self, release: bool) -> None:
+        """Stop renewing; a clean stop releases the lease, a crash leaves it to expire"""
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        if release:
+            bot._release_lease(LEASE, self.holder_id)
+
+
+class Monitor:
+    """Samples the holders every few milliseconds"""
+
+    def __init__(self, holders: list):
+        self.holders = holders
+        self.samples = 0
+        self.overlaps = 0
+        self.leaderless = 0
+        self.expect_leader = True
+
+    def leaders(self) -> list:
+        now = time.monotonic()
+        return [holder for holder in self.holders if holder.live(now)]
+
+    async def run(self) -> None:
+        while True:
+            count = len(self.leaders())
+            self.samples += 1
+            if count > 1:
+                self.overlaps += 1
+            elif count == 0 and self.expect_leader:
+                self.leaderless += 1
+            await asyncio.sleep(0.005)
+
+
+async def wait_for_leader(monitor: Monitor, exclude, timeout: float):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        leaders = monitor.leaders()
+        if len(leaders) == 1 and leaders[0] is not exclude:
+            return leaders[0], time.monotonic() - started
+        await asyncio.sleep(0.005)
+    return None, timeout
+
+
+async def run(args) -> dict:
+    use_mongomock()
+    holders = [Holder(f'holder-{i}', args.ttl) for i in range(args.holders)]
+    monitor = Monitor(holders)
+    monitor.expect_leader = False
+    monitor_task = asyncio.create_task(monitor.run())
+    for holder in holders:
+        holder.start()
+    leader, _ = await wait_for_leader(monitor, None, args.ttl * 2)
+    assert leader, "no holder took the lease"
+    monitor.expect_leader = True
+
+    results = []
+    modes = ('crash', 'release', 'stall')
+    for index in range(args.rounds):
+        mode = modes[index % len(modes)]
+        await asyncio.sleep(args.ttl)  # a few steady renewals first
+        leader = monitor.leaders()[0]
+        monitor.expect_leader = False
+        if mode == 'stall':
+            leader.stalled = True
+        else:
+            await leader.stop(release=mode == 'release')
+        limit = args.ttl / 3 + SLACK if mode == 'release' else args.ttl + args.ttl / 3 + SLACK
+        successor, took = await wait_for_leader(monitor, leader, limit)
+        monitor.expect_leader = True
+        stepped_down = None
+        if mode == 'stall':
+            leader.stalled = False
+            await asyncio.sleep(args.ttl / 3 + SLACK)
+            stepped_down = not leader.leader
+        else:
+            # Bring the stopped holder back so the pool doesn't shrink
+            leader.start()
+        results.append({
+            'mode': mode, 'from': leader.holder_id,
+            'to': successor.holder_id if successor else None,
+            'takeover_s': round(took, 3), 'limit_s': round(limit, 3),
+            'ok': successor is not None and stepped_down is not False,
+        })
+        if stepped_down is not None:
+            results[-1]['stepped_down'] = stepped_down
+
+    for holder in holders:
+        await holder.stop(release=True)
+    monitor_task.cancel()
+    await asyncio.gather(monitor_task, return_exceptions=True)
+    return {
+        'holders': args.holders, 'ttl_s': args.ttl,
+        'samples': monitor.samples, 'overlaps': monitor.overlaps, 'leaderless': monitor.leaderless,
+        'rounds': results,
+        'lease_left': bot.leases.count_documents({}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--holders', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=6)
+    parser.add_argument('--ttl', type=float, default=0.6, help='lease TTL in seconds')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    for row in report['rounds']:
+        extra = f"   stepped down: {row['stepped_down']}" if 'stepped_down' in row else ''
+        print(f"{row['mode']:<8} {row['from']} -> {row['to']}   takeover {row['takeover_s']:.3f} s "
+              f"(limit {row['limit_s']:.3f} s){extra}")
+    print(f"{report['samples']} samples, {report['overlaps']} with two leaders, "
+          f"{report['leaderless']} leaderless outside a takeover, {report['lease_left']} lease(s) left")
+    failed = (report['overlaps'] or report['leaderless'] or report['lease_left']
+              or not all(row['ok'] for row in report['rounds']))
+    print('FAIL' if failed else 'OK')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
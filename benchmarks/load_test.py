@@ -0,0 +1,216 @@
+"""Load-test the whole bot against the fake Telegram Bot API.
+
+Runs the real Application in polling mode (built by build_application, as
+main() does) against fake_telegram.py, with mongomock standing in for
+MongoDB, and simulates thousands of users. Each user arrives at
+--arrival-rate per second and goes through a session, waiting for the bot's
+answer before the next step:
+
+  /start -> /createquiz -> (for --upload-ratio of users) upload a quiz
+  and wait until all of its polls have been delivered
+
+The fake API can add latency and answer a share of sends with 429, so the
+numbers include the bot's flood handling. Reports updates/s, update-to-reply
+p50/p99 per step, handler p50/p99 and send throughput:
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/load_test.py --users 2000 --latency-ms 30 --flood-ratio 0.01
+    python benchmarks/load_test.py --users 5000 --output load.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import SEND_METHODS, FakeTelegram, command_update, document_update  # noqa: E402
+from support import bot, percentile, use_mongomock  # noqa: E402
+
+TOKEN = '123456:TEST-TOKEN'
+USER_ID_BASE = 800000
+
+QUIZ_BLOCK = (
+    "Question {n} for user {user}: which option is correct?\n"
+    "A) First option\nB) Second option\nC) Third option\nD) Fourth option\n"
+    "Answer: {answer}\n"
+)
+
+
+def record_handler_latency(samples: dict) -> None:
+    """Keep every handler timing as well as feeding the histogram, for exact percentiles"""
+    observe = bot.HANDLER_SECONDS.observe
+
+    def recording_observe(value, **labels):
+        samples[labels.get('handler', '?')].append(value)
+        observe(value, **labels)
+    bot.HANDLER_SECONDS.observe = recording_observe
+
+
+class Driver:
+    def __init__(self, fake: FakeTelegram, questions: int, upload_ratio: float, timeout: float, seed: int):
+        self.fake = fake
+        self.questions = questions
+        self.upload_ratio = upload_ratio
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.update_ids = itertools.count(1)
+        self.latencies = defaultdict(list)  # step -> update-to-reply seconds
+        self.failures = defaultdict(int)
+        self.updates = 0
+
+    async def step(self, name: str, user_id: int, update: dict, method: str = 'sendMessage', count: int = 1):
+        """Push one update and wait until the bot has made `count` more `method` calls to the user"""
+        target = self.fake.chat_calls[method, user_id] + count
+        started = time.perf_counter()
+        self.fake.push_update(update)
+        self.updates += 1
+        try:
+            await self.fake.wait_for(method, target, self.timeout, chat_id=user_id)
+        except asyncio.TimeoutError:
+            self.failures[name] += 1
+            return False
+        self.latencies[name].append(time.perf_counter() - started)
+        return True
+
+    async def session(self, user_id: int) -> None:
+        if not await self.step('/start', user_id, command_update(next(self.update_ids), user_id, '/start')):
+            return
+        if not await self.step('/createquiz', user_id, command_update(next(self.update_ids), user_id, '/createquiz')):
+            return
+        if self.random.random() >= self.upload_ratio:
+            return
+
+        file_id = f'quiz-{user_id}'
+        quiz = '\n'.join(
+            QUIZ_BLOCK.format(n=n, user=user_id, answer=n % 4 + 1) for n in range(self.questions)
+        )
+        self.fake.add_file(file_id, quiz.encode('utf-8'))
+        polls_before = self.fake.chat_calls['sendPoll', user_id]
+        started = time.perf_counter()
+        if not await self.step('upload', user_id, document_update(next(self.update_ids), user_id, file_id)):
+            return
+        try:
+            await self.fake.wait_for('sendPoll', polls_before + self.questions, self.timeout, chat_id=user_id)
+        except asyncio.TimeoutError:
+            self.failures['delivery'] += 1
+            return
+        self.latencies['delivery'].append(time.perf_counter() - started)
+
+
+def send_count(fake: FakeTelegram) -> int:
+    return sum(fake.calls[method] for method in SEND_METHODS)
+
+
+def latency_row(samples: list) -> dict:
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 0.5) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples, default=0.0) * 1000,
+    }
+
+
+async def run(args) -> dict:
+    logging.getLogger().setLevel(logging.WARNING)
+    use_mongomock()
+    if not args.throttled:
+        # Measure the bot, not the outbound scheduler's flood limits
+        bot.outbound._global = bot.TokenBucket(1e6, 1e6)
+    handler_samples = defaultdict(list)
+    record_handler_latency(handler_samples)
+
+    fake = FakeTelegram(args.latency_ms / 1000, args.jitter_ms / 1000, args.flood_ratio, args.retry_after, args.seed)
+    await fake.start()
+    application = bot.build_application(TOKEN, fake.base_url, fake.base_file_url)
+    stop_event = asyncio.Event()
+    runner = asyncio.create_task(bot.run_bot(application, stop_event=stop_event))
+    await fake.wait_for('getUpdates', timeout=60)
+
+    driver = Driver(fake, args.questions, args.upload_ratio, args.timeout, args.seed)
+    sends_before = send_count(fake)
+    sessions = []
+    started = time.perf_counter()
+    for i in range(args.users):
+        sessions.append(asyncio.create_task(driver.session(USER_ID_BASE + i)))
+        # Spread arrivals evenly; sleep in batches, the loop can't time sub-ms sleeps
+        if args.arrival_rate and (i + 1) % max(1, int(args.arrival_rate / 100)) == 0:
+            await asyncio.sleep(max(0.0, started + (i + 1) / args.arrival_rate - time.perf_counter()))
+    await asyncio.gather(*sessions)
+    elapsed = time.perf_counter() - started
+    sends = send_count(fake) - sends_before
+
+    stop_event.set()
+    await runner
+    await fake.stop()
+
+    return {
+        'config': {
+            'users': args.users, 'arrival_rate': args.arrival_rate, 'upload_ratio': args.upload_ratio,
+            'questions': args.questions, 'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+            'flood_ratio': args.flood_ratio, 'throttled': args.throttled,
+            'update_concurrency': bot.UPDATE_CONCURRENCY, 'delivery_concurrency': bot.DELIVERY_CONCURRENCY,
+        },
+        'elapsed_s': elapsed,
+        'updates': driver.updates,
+        'updates_per_s': driver.updates / elapsed,
+        'sends': sends,
+        'sends_per_s': sends / elapsed,
+        'flooded': sum(fake.flooded.values()),
+        'retry_after_hits': bot.outbound.retry_after_hits,
+        'failures': dict(driver.failures),
+        'steps': {name: latency_row(samples) for name, samples in driver.latencies.items()},
+        'handlers': {name: latency_row(samples) for name, samples in sorted(handler_samples.items())},
+    }
+
+
+def print_report(report: dict) -> None:
+    config = report['config']
+    print(f"{config['users']} users at {config['arrival_rate']:g}/s, {config['upload_ratio']:.0%} upload "
+          f"{config['questions']} questions; API latency {config['latency_ms']:g}+{config['jitter_ms']:g} ms, "
+          f"{config['flood_ratio']:.1%} flooded")
+    print(f"elapsed:      {report['elapsed_s']:8.1f} s")
+    print(f"updates:      {report['updates_per_s']:8.1f} /s   ({report['updates']} total)")
+    print(f"sends:        {report['sends_per_s']:8.1f} /s   ({report['sends']} total, "
+          f"{report['flooded']} answered 429, {report['retry_after_hits']} RetryAfter pauses)")
+    if report['failures']:
+        print(f"timed out:    {report['failures']}")
+    for section, title in (('steps', 'update -> reply'), ('handlers', 'handler')):
+        print(f"\n{title}:")
+        for name, row in report[section].items():
+            print(f"  {name:<24} n {row['count']:>6}   p50 {row['p50_ms']:9.2f} ms   "
+                  f"p99 {row['p99_ms']:9.2f} ms   max {row['max_ms']:9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--arrival-rate', type=float, default=200.0, help='new users per second, 0 for all at once')
+    parser.add_argument('--upload-ratio', type=float, default=0.2)
+    parser.add_argument('--questions', type=int, default=5, help='questions per uploaded quiz')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='added to every fake API call')
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--flood-ratio', type=float, default=0.0, help='share of sends answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--throttled', action='store_true',
+                        help="keep the outbound scheduler's global rate limit")
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for each reply')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the report as JSON here')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(report, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
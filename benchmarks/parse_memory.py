@@ -0,0 +1,101 @@
+"""Compare peak memory of the old and streaming quiz upload paths.
+
+Builds a synthetic quiz file of the requested size and measures the
+tracemalloc high-water mark (above the raw upload bytes) for:
+
+  legacy    - write to disk, read back, split('\\n\\n') + per-block lists
+  streaming - bot.parse_quiz_bytes on the in-memory download
+
+    python benchmarks/parse_memory.py --size-mb 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+BLOCK = (
+    "Question number {n}: which option is correct?\n"
+    "A) First option\n"
+    "B) Second option\n"
+    "C) Third option\n"
+    "D) Fourth option\n"
+    "Answer: {answer}\n"
+    "Explanation for question {n}\n\n"
+)
+
+
+def make_quiz(size_bytes: int) -> bytes:
+    parts = []
+    total = 0
+    n = 0
+    while total < size_bytes:
+        block = BLOCK.format(n=n, answer=n % 4 + 1)
+        parts.append(block)
+        total += len(block)
+        n += 1
+    return ''.join(parts).encode('utf-8')
+
+
+def legacy_parse(data: bytes) -> tuple:
+    """The pre-streaming path: shared file on disk, full read, split"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'quiz.txt')
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    blocks = [b.strip() for b in content.split('\n\n') if b.strip()]
+    valid_questions = []
+    errors = []
+    for i, block in enumerate(blocks):
+        lines = [line.strip() for line in block.split('\n') if line.strip()]
+        if len(lines) not in (6, 7):
+            errors.append(f"❌ Question {i+1}: Invalid line count ({len(lines)}), expected 6 or 7")
+            continue
+        correct_id = int(lines[5].split(':')[1].strip()) - 1
+        valid_questions.append((lines[0], lines[1:5], correct_id, lines[6] if len(lines) == 7 else None))
+    return valid_questions, errors
+
+
+def measure(parse, data: bytes) -> dict:
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    valid_questions, errors = parse(data)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'questions': len(valid_questions),
+        'seconds': elapsed,
+        'result_mb': (current - baseline) / 2**20,
+        'peak_mb': (peak - baseline) / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=20.0)
+    args = parser.parse_args()
+
+    data = make_quiz(int(args.size_mb * 2**20))
+    print(f"input: {len(data) / 2**20:.1f} MB")
+    for name, parse in (('legacy', legacy_parse), ('streaming', bot.parse_quiz_bytes)):
+        result = measure(parse, data)
+        overhead = result['peak_mb'] - result['result_mb']
+        print(
+            f"{name:>9}: {result['questions']} questions in {result['seconds']:.2f}s | "
+            f"peak {result['peak_mb']:7.1f} MB | parsed result {result['result_mb']:7.1f} MB | "
+            f"transient {overhead:7.1f} MB"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""Shared helpers for the benchmark and load-test scripts"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def use_mongomock():
+    """Point every collection the bot uses at an in-memory mongomock database"""
+    import mongomock
+    from pymongo.collection import Collection
+
+    mock_db = mongomock.MongoClient()[bot.DB_NAME]
+    for name, value in list(vars(bot).items()):
+        if isinstance(value, Collection):
+            setattr(bot, name, mock_db[value.name])
+    bot.db = mock_db
+    bot.parsed_quiz_cache = bot.ParsedQuizCache(
+        mock_db.quiz_cache, bot.QUIZ_MEMORY_CACHE_SIZE, bot.QUIZ_CACHE_MAX_BYTES
+    )
+    bot.premium_cache = bot.PremiumCache(bot.PREMIUM_CACHE_SIZE, bot.PREMIUM_CACHE_TTL)
+    return mock_db
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
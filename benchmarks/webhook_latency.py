@@ -0,0 +1,108 @@
+"""Measure update-to-reply latency of the webhook mode against a fake Telegram.
+
+Starts the fake Bot API from fake_telegram.py, runs the real Application in
+webhook mode against it (with mongomock standing in for MongoDB), posts
+/start updates from distinct users to the webhook concurrently and times
+each one from the POST until the bot's reply reaches the fake API.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/webhook_latency.py --updates 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram, command_update  # noqa: E402
+from support import bot, percentile, use_mongomock  # noqa: E402
+
+TOKEN = '123456:TEST-TOKEN'
+USER_ID_BASE = 500000
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run(updates: int, concurrency: int, unthrottled: bool) -> None:
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    use_mongomock()
+    if unthrottled:
+        # The fake API has no flood limits; measure the bot, not the scheduler
+        bot.outbound._global = bot.TokenBucket(1e6, 1e6)
+
+    fake = FakeTelegram()
+    await fake.start()
+    port = free_port()
+    application = bot.build_application(TOKEN, fake.base_url, fake.base_file_url)
+    stop_event = asyncio.Event()
+    server_task = asyncio.create_task(
+        bot.run_bot(application, port, f"http://127.0.0.1:{port}", stop_event)
+    )
+    await fake.wait_for('setWebhook')
+    webhook = f"http://127.0.0.1:{port}{bot.WEBHOOK_PATH}"
+    headers = {'X-Telegram-Bot-Api-Secret-Token': fake.webhook['secret_token']}
+
+    posted_at = {}
+    post_times = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        rejected = await client.post(webhook, json=command_update(0, 1, '/start'), headers={})
+        assert rejected.status_code == 403, "webhook accepted a request without the secret token"
+
+        async def post(i: int) -> None:
+            user_id = USER_ID_BASE + i
+            async with semaphore:
+                started = time.perf_counter()
+                posted_at[user_id] = started
+                response = await client.post(webhook, json=command_update(i + 1, user_id, '/start'), headers=headers)
+                response.raise_for_status()
+                post_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(updates)))
+        await fake.wait_for('sendMessage', updates, timeout=max(30, updates))
+        elapsed = time.perf_counter() - started
+
+    latencies = [
+        replied - posted_at[params['chat_id']]
+        for replied, params in fake.requests['sendMessage']
+        if params.get('chat_id') in posted_at
+    ]
+    stop_event.set()
+    await server_task
+    await fake.stop()
+
+    print(f"{updates} updates, {concurrency} concurrent posts, UPDATE_CONCURRENCY={bot.UPDATE_CONCURRENCY}")
+    print(f"throughput:        {updates / elapsed:8.1f} updates/s")
+    print(f"webhook response:  p50 {percentile(post_times, 0.5) * 1000:7.2f} ms   "
+          f"p99 {percentile(post_times, 0.99) * 1000:7.2f} ms")
+    print(f"update -> reply:   p50 {percentile(latencies, 0.5) * 1000:7.2f} ms   "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms   "
+          f"mean {statistics.fmean(latencies) * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--throttled', action='store_true',
+                        help="keep the outbound scheduler's global rate limit")
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.concurrency, unthrottled=not args.throttled))
+
+
+if __name__ == '__main__':
+    main()
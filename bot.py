@@ -1,77 +1,1039 @@
 import os
+import argparse
+import asyncio
+import atexit
+import codecs
+import contextlib
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import html
+import io
+import itertools
 import logging
+import logging.handlers
+import queue
+import sys
 import threading
 import time
 import socket
 import re
+import signal
 import json
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
+    PollAnswerHandler,
+    TypeHandler,
     filters,
     ContextTypes,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    BaseRateLimiter
 )
-from pymongo import MongoClient, ReturnDocument
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import Binary, ObjectId, json_util
 
 # Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_BURST = int(os.getenv('LOG_BURST', 20))  # records per call site per window before suppressing
+LOG_WINDOW = float(os.getenv('LOG_WINDOW', 60))  # seconds
+LOG_QUEUE_SIZE = 10000
+LOG_SUMMARY_INTERVAL = 1.0  # seconds between checks for ended windows
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if hasattr(record, 'suppressed'):
+            entry['suppressed'] = record.suppressed
+            entry['key'] = record.log_key
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogRateLimiter:
+    """Let `burst` records per `window` seconds through for each key and count the rest.
+    
+    The key is the record's `log_key` extra if it has one, otherwise its call
+    site: messages here are f-strings, so identical errors for different
+    chats never share a text, but they do share a line.
+    """
+    
+    def __init__(self, burst: int, window: float):
+        self.burst = burst
+        self.window = window
+        self._windows = {}  # key -> [started, passed, suppressed, first suppressed record]
+        self._ended = []
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(record: logging.LogRecord) -> str:
+        return getattr(record, 'log_key', None) or f"{record.name}:{record.filename}:{record.lineno}"
+    
+    def allow(self, record: logging.LogRecord) -> bool:
+        key = self.key(record)
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state and state[2]:
+                    self._ended.append((key, state))
+                self._windows[key] = [now, 1, 0, None]
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            if state[3] is None:
+                state[3] = record
+            return False
+    
+    def summaries(self) -> list:
+        """Return a summary record for every window that ended with suppressed records"""
+        now = time.monotonic()
+        with self._lock:
+            ended, self._ended = self._ended, []
+            for key, state in list(self._windows.items()):
+                if now - state[0] >= self.window:
+                    del self._windows[key]
+                    if state[2]:
+                        ended.append((key, state))
+        
+        records = []
+        for key, (started, passed, suppressed, sample) in ended:
+            records.append(logging.makeLogRecord({
+                'name': sample.name, 'levelno': sample.levelno, 'levelname': sample.levelname,
+                'msg': f"Suppressed {suppressed} more like this in {self.window:g}s: {sample.getMessage()}",
+                'suppressed': suppressed, 'log_key': key,
+            }))
+        return records
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Rate-limit records and hand them to the writer thread without blocking the caller"""
+    
+    def __init__(self, log_queue: queue.Queue, limiter: LogRateLimiter):
+        super().__init__(log_queue)
+        self.limiter = limiter
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now; the writer must not touch live objects
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        if not self.limiter.allow(record):
+            return
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+class LogWriter(threading.Thread):
+    """Format queued records and write them out in batches, off the event loop"""
+    
+    BATCH = 500
+    
+    def __init__(self, log_queue: queue.Queue, handler: LogQueueHandler, formatter: logging.Formatter, stream=None):
+        super().__init__(name='log-writer', daemon=True)
+        self.queue = log_queue
+        self.handler = handler
+        self.formatter = formatter
+        self.stream = stream or sys.stderr
+        self._stopping = False
+    
+    def _write(self, records: list) -> None:
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception as e:
+                lines.append(f"Unformattable log record from {record.name}: {e}")
+        try:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+    
+    def run(self) -> None:
+        next_summary = time.monotonic() + LOG_SUMMARY_INTERVAL
+        while True:
+            records = []
+            try:
+                records.append(self.queue.get(timeout=LOG_SUMMARY_INTERVAL))
+                while len(records) < self.BATCH:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in records
+            records = [record for record in records if record is not None]
+            
+            if stop or time.monotonic() >= next_summary:
+                records.extend(self.handler.limiter.summaries())
+                if self.handler.dropped:
+                    dropped, self.handler.dropped = self.handler.dropped, 0
+                    records.append(logging.makeLogRecord({
+                        'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                        'msg': f"Dropped {dropped} log records, the log queue was full",
+                    }))
+                next_summary = time.monotonic() + LOG_SUMMARY_INTERVAL
+            if records:
+                self._write(records)
+            if stop:
+                return
+    
+    def stop(self, timeout: float = 5) -> None:
+        """Write out what is queued, plus any pending summaries, and end the thread"""
+        if self._stopping or not self.is_alive():
+            return
+        self._stopping = True
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.join(timeout)
+
+log_writer = None
+
+def setup_logging() -> LogWriter:
+    """Route all logging through the rate limiter and a background writer.
+    
+    Called by the entry points, not at import, so importing bot.py starts
+    no threads and leaves the root logger alone.
+    """
+    global log_writer
+    if log_writer:
+        return log_writer
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = LogQueueHandler(log_queue, LogRateLimiter(LOG_BURST, LOG_WINDOW))
+    if LOG_FORMAT == 'text':
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    else:
+        formatter = JsonFormatter()
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    writer = LogWriter(log_queue, handler, formatter)
+    writer.start()
+    # Covers exits that skip the entry point's own stop()
+    atexit.register(writer.stop)
+    log_writer = writer
+    return writer
+
 logger = logging.getLogger(__name__)
 
 # Constants
 COOLDOWN_MINUTES = 10
 FREE_USER_LIMIT = 10
+QUOTA_MODE = os.getenv('QUOTA_MODE', 'fixed')  # 'fixed' or 'sliding'
 OWNER_USERNAME = "Mr_rahul090"
 IST = timezone(timedelta(hours=5, minutes=30))  # Indian Standard Time
 
 # MongoDB setup
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
-DB_NAME = 'quiz_bot'
-client = MongoClient(MONGODB_URI)
+DB_NAME = os.getenv('DB_NAME', 'quiz_bot')
+MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', 5000))
+
+# pymongo is blocking, so every database call is pushed onto a bounded
+# thread pool instead of running on the event loop.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='mongo')
+
+# connect=False defers connecting (and pymongo's monitor threads) to the
+# first operation, so importing the module has no side effects. The pool
+# matches the executor, since only its threads talk to Mongo.
+client = MongoClient(
+    MONGODB_URI,
+    connect=False,
+    appname='quiz-bot',
+    maxPoolSize=DB_POOL_SIZE,
+    minPoolSize=0,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGO_TIMEOUT_MS,
+    retryWrites=True
+)
 db = client[DB_NAME]
 users = db.users
 premium_subscriptions = db.premium_subscriptions
 plans = db.plans
+broadcasts = db.broadcasts
+stats = db.stats
+daily_active = db.daily_active
+quiz_cache = db.quiz_cache
+quiz_library = db.quiz_library
+jobs = db.jobs
+leases = db.leases
+polls = db.polls
+scores = db.scores
+
+def ensure_indexes():
+    """Create the indexes the bot relies on"""
+    users.create_index('user_id', unique=True)
+    users.create_index('updated_at')
+    premium_subscriptions.create_index('user_id')
+    premium_subscriptions.create_index('updated_at')
+    premium_subscriptions.create_index('expires_at', expireAfterSeconds=0)
+    plans.create_index('plan_name', unique=True)
+    broadcasts.create_index('status')
+    daily_active.create_index('expires_at', expireAfterSeconds=0)
+    quiz_cache.create_index('file_ids')
+    quiz_cache.create_index('last_used')
+    quiz_library.create_index([('user_id', 1), ('number', 1)], unique=True)
+    quiz_library.create_index([('user_id', 1), ('hash', 1)])
+    quiz_library.create_index([('user_id', 1), ('last_used', 1)])
+    jobs.create_index([('status', 1), ('created_at', 1)])
+    jobs.create_index('finished_at', expireAfterSeconds=JOB_KEEP_SECONDS)
+    polls.create_index('expires_at', expireAfterSeconds=0)
+    scores.create_index([('chat_id', 1), ('user_id', 1)], unique=True)
+    scores.create_index('updated_at')
+
+# Premium cache settings
+PREMIUM_CACHE_SIZE = int(os.getenv('PREMIUM_CACHE_SIZE', 10000))
+PREMIUM_CACHE_TTL = int(os.getenv('PREMIUM_CACHE_TTL', 300))  # seconds
+
+# Telegram flood limits
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', 30))  # messages per second
+TG_GROUP_RATE = float(os.getenv('TG_GROUP_RATE', 20))  # messages per minute per group
+TG_PRIVATE_RATE = float(os.getenv('TG_PRIVATE_RATE', 1))  # messages per second per private chat
+TG_MAX_RETRIES = int(os.getenv('TG_MAX_RETRIES', 3))
+TG_BURST = 1  # tokens group and global buckets start with; more lets a burst exceed the limit
+TG_GLOBAL_PAUSE_CHATS = 3  # chats flood-limited at once before all sends pause
+
+# Broadcast settings
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 200))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 25))
+BROADCAST_PROGRESS_INTERVAL = 5  # seconds between progress edits
+
+# Parsed quiz cache settings
+QUIZ_MEMORY_CACHE_SIZE = int(os.getenv('QUIZ_MEMORY_CACHE_SIZE', 64))  # entries
+QUIZ_CACHE_MAX_BYTES = int(os.getenv('QUIZ_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+QUIZ_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+QUIZ_PARSER_VERSION = 2  # bump when parsing changes to ignore older cache entries
+
+# Health and metrics settings
+READY_CHECK_INTERVAL = int(os.getenv('READY_CHECK_INTERVAL', 15))  # seconds
+LOOP_LAG_INTERVAL = 1.0  # seconds
+
+# Webhook mode is enabled by setting WEBHOOK_URL to the bot's public base URL
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+# Alternative Bot API server, e.g. a local telegram-bot-api or a test double
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_BODY = 1024 * 1024  # bytes
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 16))
+
+# Quiz library settings
+LIBRARY_PAGE_SIZE = 10
+LIBRARY_MAX_BYTES = 8 * 1024 * 1024  # compressed questions per saved quiz
+LIBRARY_MAX_QUIZZES = int(os.getenv('LIBRARY_MAX_QUIZZES', 100))  # per user; least recently used go first
+
+# Write-behind buffer for per-update user writes
+USER_FLUSH_INTERVAL = float(os.getenv('USER_FLUSH_INTERVAL', 1.0))  # seconds
+USER_FLUSH_BATCH = 500
+KNOWN_USERS_SIZE = 100000
 
-# Ensure indexes
-users.create_index('user_id', unique=True)
-premium_subscriptions.create_index('user_id')
-premium_subscriptions.create_index('expires_at', expireAfterSeconds=0)
-plans.create_index('plan_name', unique=True)
+# Quiz scores
+SCORE_FLUSH_INTERVAL = float(os.getenv('SCORE_FLUSH_INTERVAL', 5))  # seconds
+SCORE_RELOAD_INTERVAL = 300  # seconds; picks up answers scored by other replicas
+SCORE_RELOAD_LAG = 60  # seconds; rows stamped just before a reload may not be visible to it yet
+SCORE_BOARD_IDLE = 3600  # seconds; chat boards unused this long are dropped from memory
+SCORE_MAX_NAMES = 50000  # display names kept in memory; the rest are read from `scores`
+POLL_KEEP_SECONDS = 3600  # how long a sent poll can still be scored
+LEADERBOARD_SIZE = 10
+
+# Quiz delivery
+DELIVERY_CONCURRENCY = int(os.getenv('DELIVERY_CONCURRENCY', 30))  # polls being sent at once
+DELIVERY_MAX_ACTIVE = int(os.getenv('DELIVERY_MAX_ACTIVE', 100))  # deliveries claimed per process
+DELIVERY_PROGRESS_EVERY = 25  # questions between progress updates
+DELIVERY_PROGRESS_INTERVAL = 5  # seconds between progress updates
+
+# Premium expiry notifications
+EXPIRY_WARNING = 24 * 60 * 60  # seconds before expiry to warn the user
+EXPIRY_RESYNC_INTERVAL = 60  # seconds; picks up changes made by other replicas
+
+# Worker and job queue settings
+CLUSTER_MODE = os.getenv('CLUSTER_MODE', '').lower() in ('1', 'true', 'yes')
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL = int(os.getenv('LEASE_TTL', 30))  # seconds
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', 8))
+JOB_POLL_INTERVAL = 2  # seconds between queue checks when idle
+JOB_HEARTBEAT_INTERVAL = 10  # seconds
+JOB_STALE_AFTER = 45  # seconds without a heartbeat before a job is reclaimed
+JOB_DRAIN_TIMEOUT = float(os.getenv('JOB_DRAIN_TIMEOUT', 10))  # seconds jobs get to stop cleanly at shutdown
+JOB_MAX_ATTEMPTS = 3
+JOB_KEEP_SECONDS = 7 * 24 * 3600  # finished jobs are kept this long, for debugging
 
 # Load environment variables
 OWNER_ID = int(os.getenv('OWNER_ID', 0))
 BOT_USERNAME = os.getenv('BOT_USERNAME', 'your_bot')
 
-# Helper functions
-def get_user_data(user_id: int) -> dict:
-    return users.find_one_and_update(
-        {'user_id': user_id},
-        {'$setOnInsert': {
-            'quiz_count': 0,
-            'last_quiz_time': 0
+# Metrics
+# A small Prometheus text-format registry, so /metrics needs no extra
+# dependency. Metrics may be updated from the database threads, hence the lock.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+class Metric:
+    def __init__(self, name: str, help_text: str, kind: str):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._values = {}
+    
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text, 'counter')
+    
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    def __init__(self, name: str, help_text: str, func=None):
+        super().__init__(name, help_text, 'gauge')
+        self.func = func
+    
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+    
+    def render(self) -> list:
+        if self.func:
+            self.set(self.func())
+        return super().render()
+
+class Histogram(Metric):
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, 'histogram')
+        self.buckets = buckets
+    
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+    
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+HANDLER_SECONDS = metrics.register(Histogram('bot_handler_seconds', 'Update handler latency'))
+HANDLER_ERRORS = metrics.register(Counter('bot_handler_errors_total', 'Exceptions raised by update handlers'))
+MONGO_SECONDS = metrics.register(Histogram('bot_mongo_operation_seconds', 'MongoDB operation time'))
+TELEGRAM_REQUESTS = metrics.register(Counter('bot_telegram_requests_total', 'Bot API requests by endpoint and result'))
+LOOP_LAG = metrics.register(Histogram('bot_event_loop_lag_seconds', 'Event loop scheduling delay'))
+STARTUP_SECONDS = metrics.register(Gauge('bot_startup_seconds', 'Seconds from module load to each startup phase'))
+
+readiness = {'mongo': False, 'telegram': False, 'checked_at': 0.0}
+
+class StartupTimer:
+    """Record when each startup phase finished, relative to module load"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+    
+    def mark(self, phase: str) -> None:
+        if phase in self.phases:
+            return
+        elapsed = time.perf_counter() - self.started
+        previous = max(self.phases.values(), default=0.0)
+        self.phases[phase] = elapsed
+        STARTUP_SECONDS.set(elapsed, phase=phase)
+        logger.info(f"Startup: {phase} at {elapsed * 1000:.0f} ms (+{(elapsed - previous) * 1000:.0f} ms)")
+
+startup = StartupTimer()
+
+class PremiumCache:
+    """Bounded LRU cache of premium subscriptions keyed by user_id.
+    
+    Stores the active subscription document (or None for free users).
+    An entry is dropped after `ttl` seconds or as soon as the
+    subscription's `expires_at` passes, whichever comes first.
+    """
+    
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    
+    def get(self, user_id: int) -> tuple:
+        """Return (found, subscription) for a user"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        
+        sub, valid_until = entry
+        if time.time() >= valid_until:
+            del self._entries[user_id]
+            self.misses += 1
+            return False, None
+        
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return True, sub
+    
+    def put(self, user_id: int, sub) -> None:
+        valid_until = time.time() + self.ttl
+        if sub:
+            expires_at = sub['expires_at']
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            valid_until = min(valid_until, expires_at.timestamp())
+        
+        self._entries[user_id] = (sub, valid_until)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+premium_cache = PremiumCache(PREMIUM_CACHE_SIZE, PREMIUM_CACHE_TTL)
+
+# Data access layer
+def _timed_db_call(func, args, kwargs):
+    collection = getattr(getattr(func, '__self__', None), 'name', '')
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        MONGO_SECONDS.observe(
+            time.perf_counter() - started,
+            op=getattr(func, '__name__', 'call'), collection=collection
+        )
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking pymongo call on the database thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, _timed_db_call, func, args, kwargs)
+
+class UserWriteBuffer:
+    """Coalesce per-update user writes and flush them with bulk_write.
+    
+    Handlers call touch() on every interaction. Users already known to exist
+    only get their `last_seen`/`interactions` fields bumped at the next flush;
+    unknown users get an upsert that also sets the insert defaults and
+    clears a `blocked` flag left by a failed broadcast. Every pending write
+    for a user collapses into one UpdateOne, and a flush sends them as
+    unordered bulk_write batches.
+    """
+    
+    def __init__(self, max_batch: int = USER_FLUSH_BATCH, known_size: int = KNOWN_USERS_SIZE):
+        self.max_batch = max_batch
+        self.known_size = known_size
+        self._known = OrderedDict()
+        self._pending = {}
+        # Made in run(): before Python 3.10 an Event binds to the loop current at creation
+        self._full = None
+    
+    def touch(self, user_id: int) -> None:
+        now = time.time()
+        entry = self._pending.get(user_id)
+        if entry is None:
+            entry = self._pending[user_id] = {'last_seen': now, 'interactions': 0}
+        entry['last_seen'] = now
+        entry['interactions'] += 1
+        if len(self._pending) >= self.max_batch and self._full:
+            self._full.set()
+    
+    def forget(self, user_ids) -> None:
+        """Drop users from the known set, e.g. after flagging them as blocked"""
+        for user_id in user_ids:
+            self._known.pop(user_id, None)
+    
+    def _operation(self, user_id: int, entry: dict) -> UpdateOne:
+        update = {
+            '$max': {'last_seen': entry['last_seen']},
+            '$inc': {'interactions': entry['interactions']},
+            '$set': {'updated_at': datetime.utcnow()}
+        }
+        if user_id in self._known:
+            return UpdateOne({'user_id': user_id}, update)
+        update['$setOnInsert'] = {'quiz_count': 0, 'last_quiz_time': 0, 'first_seen': entry['last_seen']}
+        # A user talking to the bot again has evidently unblocked it
+        update['$unset'] = {'blocked': ''}
+        return UpdateOne({'user_id': user_id}, update, upsert=True)
+    
+    async def _write(self, batch: list) -> tuple:
+        """Write one batch; return (new_users, failed user_ids)"""
+        operations = [self._operation(user_id, entry) for user_id, entry in batch]
+        try:
+            result = await run_db(users.bulk_write, operations, ordered=False)
+            return result.upserted_count, []
+        except BulkWriteError as e:
+            failed = [batch[error['index']][0] for error in e.details['writeErrors']]
+            return e.details.get('nUpserted', 0), failed
+        except Exception as e:
+            logger.warning(f"User write flush failed, retrying later: {e}")
+            return 0, [user_id for user_id, _ in batch]
+    
+    def _remember(self, user_id: int) -> None:
+        self._known[user_id] = True
+        self._known.move_to_end(user_id)
+        if len(self._known) > self.known_size:
+            self._known.popitem(last=False)
+    
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        if self._full:
+            self._full.clear()
+        items = list(pending.items())
+        for start in range(0, len(items), self.max_batch):
+            batch = items[start:start + self.max_batch]
+            new_users, failed = await self._write(batch)
+            failed = set(failed)
+            for user_id, entry in batch:
+                if user_id not in failed:
+                    self._remember(user_id)
+                elif user_id not in self._pending:
+                    self._pending[user_id] = entry
+                else:
+                    newer = self._pending[user_id]
+                    newer['interactions'] += entry['interactions']
+            if new_users:
+                await record_event(new_users=new_users)
+    
+    async def run(self, interval: float = USER_FLUSH_INTERVAL) -> None:
+        """Flush every `interval` seconds, or as soon as a batch fills up"""
+        self._full = asyncio.Event()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._full.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+                if self._pending:
+                    await self.flush()
+        finally:
+            # Drain on shutdown so no interaction is lost
+            if self._pending:
+                await self.flush()
+
+user_writes = UserWriteBuffer()
+
+async def update_user_data(user_id: int, update: dict):
+    await run_db(users.update_one, {'user_id': user_id}, {'$set': {**update, 'updated_at': datetime.utcnow()}})
+
+async def is_premium(user_id: int) -> bool:
+    return bool(await get_premium_subscription(user_id))
+
+async def get_premium_subscription(user_id: int):
+    """Return the active subscription document for a user, if any"""
+    if premium_expiry.loaded:
+        return premium_expiry.active(user_id)
+    
+    found, sub = premium_cache.get(user_id)
+    if found:
+        return sub
+    
+    sub = await run_db(premium_subscriptions.find_one, {
+        'user_id': user_id,
+        'expires_at': {'$gt': datetime.utcnow()}
+    })
+    premium_cache.put(user_id, sub)
+    return sub
+
+async def remove_premium_subscription(user_id: int) -> bool:
+    result = await run_db(premium_subscriptions.delete_one, {'user_id': user_id})
+    premium_cache.invalidate(user_id)
+    premium_expiry.cancel(user_id)
+    if result.deleted_count > 0:
+        await record_event(premium_removed=1)
+    return result.deleted_count > 0
+
+async def count_users() -> int:
+    return await run_db(users.count_documents, {})
+
+async def count_broadcast_recipients() -> int:
+    return await run_db(users.count_documents, {'blocked': {'$ne': True}})
+
+def _fixed_window_pipeline(now: float, amount: int) -> list:
+    """Reset the counter once the cooldown has passed, then try to add `amount`"""
+    window = COOLDOWN_MINUTES * 60
+    consumed = {'$and': ['$quota_accepted', amount > 0]}
+    return [
+        {'$set': {
+            '_reset': {'$gte': [
+                {'$subtract': [now, {'$ifNull': ['$last_quiz_time', 0]}]}, window
+            ]}
         }},
-        upsert=True,
-        return_document=ReturnDocument.AFTER
+        {'$set': {
+            '_used': {'$cond': ['$_reset', 0, {'$ifNull': ['$quiz_count', 0]}]}
+        }},
+        {'$set': {
+            'quota_accepted': {'$lte': [{'$add': ['$_used', amount]}, FREE_USER_LIMIT]}
+        }},
+        {'$set': {
+            'quiz_count': {'$cond': [consumed, {'$add': ['$_used', amount]}, '$_used']},
+            'last_quiz_time': {'$cond': [
+                {'$or': [consumed, '$_reset']}, now, '$last_quiz_time'
+            ]}
+        }},
+        {'$set': {'first_seen': {'$ifNull': ['$first_seen', now]}, 'updated_at': datetime.utcnow()}},
+        {'$project': {'_reset': 0, '_used': 0, 'quota_accepted': 0}}
+    ]
+
+def _sliding_window_pipeline(now: float, amount: int) -> list:
+    """Count questions sent in the last COOLDOWN_MINUTES, then try to add `amount`"""
+    window = COOLDOWN_MINUTES * 60
+    consumed = {'$and': ['$quota_accepted', amount > 0]}
+    return [
+        {'$set': {
+            'quota_events': {'$filter': {
+                'input': {'$ifNull': ['$quota_events', []]},
+                'cond': {'$gt': ['$$this.t', now - window]}
+            }}
+        }},
+        {'$set': {'_used': {'$sum': '$quota_events.n'}}},
+        {'$set': {
+            'quota_accepted': {'$lte': [{'$add': ['$_used', amount]}, FREE_USER_LIMIT]}
+        }},
+        {'$set': {
+            'quota_events': {'$cond': [
+                consumed,
+                {'$concatArrays': ['$quota_events', [{'t': now, 'n': amount}]]},
+                '$quota_events'
+            ]},
+            'quiz_count': {'$cond': [consumed, {'$add': ['$_used', amount]}, '$_used']},
+            'last_quiz_time': {'$cond': [
+                consumed, now, {'$ifNull': ['$last_quiz_time', 0]}
+            ]}
+        }},
+        {'$set': {'first_seen': {'$ifNull': ['$first_seen', now]}, 'updated_at': datetime.utcnow()}},
+        {'$project': {'_used': 0, 'quota_accepted': 0}}
+    ]
+
+def _consume_quota(user_id: int, amount: int) -> tuple:
+    now = time.time()
+    if QUOTA_MODE == 'sliding':
+        pipeline = _sliding_window_pipeline(now, amount)
+    else:
+        pipeline = _fixed_window_pipeline(now, amount)
+    
+    try:
+        user = users.find_one_and_update(
+            {'user_id': user_id}, pipeline,
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race for a brand new user; the document exists now
+        user = users.find_one_and_update(
+            {'user_id': user_id}, pipeline,
+            return_document=ReturnDocument.AFTER
+        )
+    
+    if user['first_seen'] == now:
+        try:
+            _record_event(new_users=1)
+        except Exception as e:
+            logger.warning(f"Couldn't record new user {user_id}: {e}")
+    
+    if amount:
+        # Only a consumed request stamps last_quiz_time with `now` and leaves
+        # a non-zero count (a fixed-window reset alone leaves it at 0)
+        accepted = user['last_quiz_time'] == now and user['quiz_count'] > 0
+    else:
+        accepted = user['quiz_count'] <= FREE_USER_LIMIT
+    return (accepted, *quota_status(user, now))
+
+def quota_status(user: dict, now: float) -> tuple:
+    """Return (remaining, retry_after_seconds) for a user document, without writing"""
+    window = COOLDOWN_MINUTES * 60
+    last_quiz_time = user.get('last_quiz_time', 0)
+    if QUOTA_MODE == 'sliding':
+        events = [event for event in user.get('quota_events', []) if event['t'] > now - window]
+        used = sum(event['n'] for event in events)
+        retry_after = (events[0]['t'] if events else last_quiz_time) + window - now
+    else:
+        used = user.get('quiz_count', 0) if now - last_quiz_time < window else 0
+        retry_after = last_quiz_time + window - now
+    return max(0, FREE_USER_LIMIT - used), max(0, int(retry_after))
+
+async def consume_quota(user_id: int, amount: int) -> tuple:
+    """Atomically reserve `amount` free-tier questions for a user.
+    
+    The cooldown reset, the limit check and the increment happen in a
+    single find_one_and_update, so concurrent uploads cannot both pass the
+    limit. Pass amount=0 to only check the quota.
+    
+    Returns (accepted, remaining, retry_after_seconds).
+    """
+    return await run_db(_consume_quota, user_id, amount)
+
+# Per-update user context
+_UNLOADED = object()
+
+def _load_user_context(user_id: int, with_subscription: bool) -> tuple:
+    """Fetch (user document, active subscription) in one round trip (blocking, call through run_db)"""
+    if not with_subscription:
+        return users.find_one({'user_id': user_id}), _UNLOADED
+    rows = list(users.aggregate([
+        {'$match': {'user_id': user_id}},
+        {'$limit': 1},
+        {'$lookup': {
+            'from': premium_subscriptions.name,
+            'localField': 'user_id',
+            'foreignField': 'user_id',
+            'as': 'subscriptions'
+        }}
+    ]))
+    now = datetime.utcnow()
+    if not rows:
+        # No user document yet, but premium can be granted before a first message
+        sub = premium_subscriptions.find_one({'user_id': user_id, 'expires_at': {'$gt': now}})
+        return None, sub
+    user = rows[0]
+    subs = [sub for sub in user.pop('subscriptions') if sub['expires_at'] > now]
+    return user, subs[0] if subs else None
+
+class UserContext:
+    """The user behind one update, loaded at most once for all of its handlers.
+    
+    The subscription comes from the in-memory expiry schedule once it has
+    loaded, so most updates never touch Mongo. The user document, and the
+    subscription before then, come from a single round trip the first time
+    a handler asks for them.
+    """
+    
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self._user = _UNLOADED
+        self._subscription = _UNLOADED
+        self._lock = asyncio.Lock()
+    
+    async def _load(self) -> None:
+        async with self._lock:
+            if self._user is not _UNLOADED:
+                return
+            with_subscription = self._subscription is _UNLOADED
+            user, sub = await run_db(_load_user_context, self.user_id, with_subscription)
+            self._user = user
+            if with_subscription:
+                self._subscription = sub
+                premium_cache.put(self.user_id, sub)
+    
+    async def subscription(self):
+        """Return the active subscription document, if any"""
+        if self._subscription is _UNLOADED:
+            if premium_expiry.loaded:
+                self._subscription = premium_expiry.active(self.user_id)
+            else:
+                found, sub = premium_cache.get(self.user_id)
+                if found:
+                    self._subscription = sub
+                else:
+                    await self._load()
+        return self._subscription
+    
+    async def premium(self) -> bool:
+        return bool(await self.subscription())
+    
+    async def user(self):
+        """Return the user document, or None for a user the bot hasn't stored yet"""
+        if self._user is _UNLOADED:
+            await self._load()
+        return self._user
+    
+    async def free_quota(self) -> tuple:
+        """Return (remaining, retry_after_seconds) of the free tier, as of the update"""
+        user = await self.user()
+        if user is None:
+            return FREE_USER_LIMIT, 0
+        return quota_status(user, time.time())
+
+def user_context(update: Update, context) -> UserContext:
+    """Return the update's UserContext, attaching one if the middleware didn't run"""
+    account = getattr(context, 'user_context', None)
+    if account is None or account.user_id != update.effective_user.id:
+        account = context.user_context = UserContext(update.effective_user.id)
+    return account
+
+async def load_user_context(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Middleware: give every handler of this update the same UserContext"""
+    if update.effective_user and not update.poll_answer:
+        context.user_context = UserContext(update.effective_user.id)
+
+# Statistics
+# Counters live in the `stats` collection: one 'totals' document plus one
+# rollup document per IST day keyed by its date, so /stats never has to
+# scan the users collection.
+STATS_HISTORY_DAYS = 30
+
+def stats_day(dt: datetime = None) -> str:
+    dt = dt or datetime.now(timezone.utc)
+    return dt.astimezone(IST).strftime('%Y-%m-%d')
+
+def _record_event(**counters) -> None:
+    day = stats_day()
+    stats.bulk_write([
+        UpdateOne({'_id': 'totals'}, {'$inc': counters}, upsert=True),
+        UpdateOne({'_id': day}, {'$inc': counters}, upsert=True)
+    ], ordered=False)
+
+async def record_event(**counters) -> None:
+    """Increment counters in the running totals and today's rollup"""
+    try:
+        await run_db(_record_event, **counters)
+    except Exception as e:
+        logger.warning(f"Couldn't record stats {counters}: {e}")
+
+active_today = {'day': None, 'users': set()}
+
+async def record_active_user(user_id: int) -> None:
+    """Count a user once per day in the daily active figure"""
+    day = stats_day()
+    if active_today['day'] != day:
+        active_today['day'] = day
+        active_today['users'] = set()
+    if user_id in active_today['users']:
+        return
+    active_today['users'].add(user_id)
+    
+    result = await run_db(
+        daily_active.update_one,
+        {'_id': f"{day}:{user_id}"},
+        {'$setOnInsert': {'expires_at': datetime.utcnow() + timedelta(days=2)}},
+        upsert=True
     )
+    if result.upserted_id is not None:
+        await record_event(active_users=1)
 
-def update_user_data(user_id: int, update: dict):
-    users.update_one({'user_id': user_id}, {'$set': update})
+async def record_quiz(user_id: int, questions_sent: int) -> None:
+    await record_active_user(user_id)
+    await record_event(quizzes=1, questions_sent=questions_sent)
 
-def is_premium(user_id: int) -> bool:
-    return bool(premium_subscriptions.find_one({
-        'user_id': user_id,
+def seed_stats() -> None:
+    """Count the users that predate the running totals into them, once.
+    
+    This runs while updates are already being handled, so `totals` may have
+    been created by an event first; seeding is claimed with its own marker
+    document and added with $inc instead.
+    """
+    if stats.find_one({'_id': 'seeded'}):
+        return
+    if users.find_one({'first_seen': 0}, {'_id': 1}):
+        # Seeded by a release that ran this before any event, without the marker
+        try:
+            stats.insert_one({'_id': 'seeded', 'new_users': None, 'at': datetime.utcnow()})
+        except DuplicateKeyError:
+            pass
+        return
+    
+    existing = users.count_documents({'first_seen': {'$exists': False}})
+    try:
+        stats.insert_one({'_id': 'seeded', 'new_users': existing, 'at': datetime.utcnow()})
+    except DuplicateKeyError:
+        return  # another replica is seeding
+    # Existing users must not be counted as new the first time they are seen
+    users.update_many({'first_seen': {'$exists': False}}, {'$set': {'first_seen': 0, 'updated_at': datetime.utcnow()}})
+    stats.update_one({'_id': 'totals'}, {'$inc': {'new_users': existing}}, upsert=True)
+    logger.info(f"Seeded statistics with {existing} existing users")
+
+def get_bot_stats() -> dict:
+    """Collect owner statistics (blocking, call through run_db)"""
+    day = stats_day()
+    docs = {doc['_id']: doc for doc in stats.find({'_id': {'$in': ['totals', day]}})}
+    active_premium = premium_subscriptions.count_documents({
         'expires_at': {'$gt': datetime.utcnow()}
-    }))
+    })
+    return {
+        'totals': docs.get('totals', {}),
+        'today': docs.get(day, {}),
+        'active_premium': active_premium
+    }
+
+def get_stats_history(days: int = STATS_HISTORY_DAYS) -> list:
+    """Return the daily rollups for the last `days` days, newest first"""
+    first_day = stats_day(datetime.now(timezone.utc) - timedelta(days=days - 1))
+    return list(stats.find({'_id': {'$gte': first_day, '$lte': stats_day()}}).sort('_id', -1))
 
-def add_premium_subscription(user_id: int, duration: str):
+async def add_premium_subscription(user_id: int, duration: str):
     match = re.match(r'(\d+)\s*(day|month|year)s?', duration.lower())
     if not match:
         raise ValueError("Invalid duration format")
@@ -87,14 +1049,178 @@ def add_premium_subscription(user_id: int, duration: str):
         expires_at = datetime.utcnow() + timedelta(days=quantity*365)
     else:
         raise ValueError("Unsupported time unit")
+    # Mongo keeps milliseconds; match it so the in-memory schedule compares equal
+    expires_at = expires_at.replace(microsecond=expires_at.microsecond // 1000 * 1000)
     
-    premium_subscriptions.update_one(
+    await run_db(
+        premium_subscriptions.update_one,
         {'user_id': user_id},
-        {'$set': {'expires_at': expires_at}},
+        {'$set': {'expires_at': expires_at, 'updated_at': datetime.utcnow()}},
         upsert=True
     )
+    premium_cache.invalidate(user_id)
+    premium_expiry.schedule(user_id, expires_at)
+    await record_event(premium_granted=1)
     return expires_at
 
+class TokenBucket:
+    """Async token bucket refilled at `rate` tokens per second up to `capacity`"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = None
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity and not (self._lock and self._lock.locked())
+    
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class OutboundScheduler(BaseRateLimiter):
+    """Throttle every outgoing Bot API request to stay under Telegram's flood limits.
+    
+    Requests that target a chat take a token from that chat's bucket
+    (TG_GROUP_RATE per minute for groups, TG_PRIVATE_RATE per second for
+    private chats) and then from the global TG_GLOBAL_RATE bucket.
+    RetryAfter pauses sends to the chat that got it for the requested time;
+    requests without a chat, or several chats flood-limited at once, pause
+    all sends. Transient network errors are retried with exponential backoff.
+    """
+    
+    MAX_CHAT_BUCKETS = 1024
+    
+    def __init__(self, max_retries: int = TG_MAX_RETRIES):
+        self.max_retries = max_retries
+        self._global = TokenBucket(TG_GLOBAL_RATE, TG_BURST)
+        self._chats = {}
+        self._resume_at = 0.0
+        self._chat_resume_at = {}
+        self.queued = 0
+        self.sent = 0
+        self.retry_after_hits = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        self._chats.clear()
+    
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            # Groups and channels have negative ids or @usernames
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(TG_GROUP_RATE / 60, TG_BURST)
+            else:
+                bucket = TokenBucket(TG_PRIVATE_RATE, max(1, TG_PRIVATE_RATE * 3))
+            self._chats[chat_id] = bucket
+        return bucket
+    
+    async def _wait_for_slot(self, chat_id) -> None:
+        started = time.monotonic()
+        self.queued += 1
+        try:
+            while True:
+                resume_at = max(self._resume_at, self._chat_resume_at.get(chat_id, 0.0))
+                pause = resume_at - time.monotonic()
+                if pause <= 0:
+                    break
+                await asyncio.sleep(pause)
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+                await self._global.acquire()
+        finally:
+            self.queued -= 1
+            waited = time.monotonic() - started
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        attempt = 0
+        while True:
+            await self._wait_for_slot(chat_id)
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                TELEGRAM_REQUESTS.inc(endpoint=endpoint, result='ok')
+                return result
+            except RetryAfter as e:
+                self.retry_after_hits += 1
+                TELEGRAM_REQUESTS.inc(endpoint=endpoint, result='retry_after')
+                self._pause(chat_id, e.retry_after, endpoint)
+                backoff = 0
+                error = e
+            except TimedOut:
+                # The request may already have been delivered; retrying could duplicate it
+                self.errors += 1
+                TELEGRAM_REQUESTS.inc(endpoint=endpoint, result='timeout')
+                raise
+            except NetworkError as e:
+                TELEGRAM_REQUESTS.inc(endpoint=endpoint, result='network_error')
+                backoff = min(30, 2 ** attempt)
+                error = e
+            except Exception:
+                TELEGRAM_REQUESTS.inc(endpoint=endpoint, result='error')
+                raise
+            
+            attempt += 1
+            if attempt > self.max_retries:
+                self.errors += 1
+                raise error
+            self.retries += 1
+            await asyncio.sleep(backoff)
+    
+    def _pause(self, chat_id, retry_after: float, endpoint: str) -> None:
+        now = time.monotonic()
+        until = now + retry_after + 0.1
+        self._chat_resume_at = {k: t for k, t in self._chat_resume_at.items() if t > now}
+        if chat_id is None or len(self._chat_resume_at) + 1 >= TG_GLOBAL_PAUSE_CHATS:
+            logger.warning(f"Flood limit hit on {endpoint}, pausing all sends for {retry_after}s")
+            self._resume_at = max(self._resume_at, until)
+        else:
+            logger.warning(f"Flood limit hit on {endpoint} for chat {chat_id}, pausing it for {retry_after}s")
+            self._chat_resume_at[chat_id] = max(self._chat_resume_at.get(chat_id, 0.0), until)
+    
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'retry_after': self.retry_after_hits,
+            'retries': self.retries,
+            'errors': self.errors,
+            'avg_wait_ms': self.total_wait / self.sent * 1000 if self.sent else 0.0,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+outbound = OutboundScheduler()
+metrics.register(Gauge('bot_outbound_queue_depth', 'Requests waiting for a send slot', lambda: outbound.queued))
+
 def format_ist(dt: datetime) -> tuple:
     """Convert UTC datetime to IST and format for display"""
     if dt.tzinfo is None:
@@ -104,41 +1230,197 @@ def format_ist(dt: datetime) -> tuple:
     time_str = ist_dt.strftime('%I:%M:%S %p').lstrip('0')
     return date_str, time_str
 
+def instrumented(callback):
+    """Wrap an update handler to record its latency and errors"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        startup.mark('first_update')
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=callback.__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=callback.__name__)
+    return wrapper
+
+async def monitor_loop_lag() -> None:
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG.observe(max(0.0, time.perf_counter() - started - LOOP_LAG_INTERVAL))
+
+async def monitor_readiness(application: Application) -> None:
+    """Refresh the cached readiness state so health probes never wait on Mongo"""
+    while True:
+        try:
+            await asyncio.wait_for(run_db(client.admin.command, 'ping'), timeout=5)
+            readiness['mongo'] = True
+        except Exception as e:
+            if readiness['mongo']:
+                logger.warning(f"MongoDB ping failed: {e}")
+            readiness['mongo'] = False
+        
+        updater = application.updater
+        # Standby workers in CLUSTER_MODE don't poll but still run jobs
+        receiving = bool(WEBHOOK_URL) or CLUSTER_MODE or updater is None or updater.running
+        readiness['telegram'] = application.running and receiving
+        readiness['checked_at'] = time.time()
+        await asyncio.sleep(READY_CHECK_INTERVAL)
+
+def is_ready() -> bool:
+    fresh = time.time() - readiness['checked_at'] < READY_CHECK_INTERVAL * 3
+    return fresh and readiness['mongo'] and readiness['telegram']
+
+def health_response(path: str) -> tuple:
+    """Return (status, body, content_type) for the health and metrics endpoints"""
+    # Liveness: the process is up and serving
+    if path in ['/', '/health', '/status']:
+        return 200, b'OK', 'text/plain'
+    if path == '/ready':
+        return 200 if is_ready() else 503, json.dumps(readiness).encode(), 'application/json'
+    if path == '/metrics':
+        return 200, metrics.render().encode(), 'text/plain; version=0.0.4'
+    return 404, b'404 Not Found', 'text/plain'
+
 class HealthCheckHandler(BaseHTTPRequestHandler):
-    """Simplified health check handler for Render.com"""
+    """Health, readiness and metrics endpoints for Render.com"""
     server_version = "TelegramQuizBot/6.0"
     
+    def _respond(self, status: int, body: bytes, content_type: str = 'text/plain') -> None:
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
     def do_GET(self):
         try:
-            # Health check endpoints
-            if self.path in ['/', '/health', '/status']:
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'OK')
-                logger.info(f"Health check OK for {self.path}")
-            else:
-                self.send_response(404)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'404 Not Found')
+            self._respond(*health_response(self.path))
         except Exception as e:
             logger.error(f"Health check error: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b'500 Internal Server Error')
+            self._respond(500, b'500 Internal Server Error')
 
     def log_message(self, format, *args):
         """Override to prevent default logging"""
         pass
 
+class WebhookServer:
+    """Serve the Telegram webhook and the health/metrics endpoints on one port.
+    
+    A minimal asyncio HTTP/1.1 server running on the bot's own event loop.
+    Webhook requests must carry the secret token Telegram was given in
+    setWebhook; their updates are queued on the application, which handles
+    up to UPDATE_CONCURRENCY of them at once.
+    """
+    
+    IDLE_TIMEOUT = 75  # seconds a keep-alive connection may sit idle
+    
+    def __init__(self, application: Application, path: str, secret: str):
+        self.application = application
+        self.path = path
+        self.secret = secret
+        self.server = None
+    
+    async def start(self, host: str, port: int) -> None:
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+    
+    async def stop(self) -> None:
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+    
+    async def _read_request(self, reader) -> tuple:
+        request_line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        length = int(headers.get('content-length', 0))
+        if length > WEBHOOK_MAX_BODY:
+            raise ValueError(f"Request body too large ({length} bytes)")
+        body = await reader.readexactly(length) if length else b''
+        return method, path.split('?', 1)[0], headers, body
+    
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    logger.warning(f"Bad webhook request: {e}")
+                    request = None
+                    await self._write(writer, 400, b'Bad Request', 'text/plain', keep_alive=False)
+                if request is None:
+                    break
+                
+                method, path, headers, body = request
+                try:
+                    status, payload, content_type = await self._dispatch(method, path, headers, body)
+                except Exception as e:
+                    logger.error(f"Webhook server error on {path}: {e}")
+                    status, payload, content_type = 500, b'500 Internal Server Error', 'text/plain'
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._write(writer, status, payload, content_type, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+    
+    @staticmethod
+    async def _write(writer, status: int, body: bytes, content_type: str, keep_alive: bool) -> None:
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+    
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes) -> tuple:
+        if path != self.path:
+            if method != 'GET':
+                return 405, b'405 Method Not Allowed', 'text/plain'
+            return health_response(path)
+        
+        if method != 'POST':
+            return 405, b'405 Method Not Allowed', 'text/plain'
+        token = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token, self.secret):
+            logger.warning("Rejected webhook request with a bad secret token")
+            return 403, b'403 Forbidden', 'text/plain'
+        
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # A 5xx would make Telegram redeliver the same body again and again
+            logger.warning(f"Rejected a malformed webhook update: {e!r}", extra={'log_key': 'bad_webhook_update'})
+            return 400, b'400 Bad Request', 'text/plain'
+        if update is None:
+            logger.warning("Rejected an empty webhook update", extra={'log_key': 'bad_webhook_update'})
+            return 400, b'400 Bad Request', 'text/plain'
+        await self.application.update_queue.put(update)
+        return 200, b'', 'text/plain'
+
 def run_http_server(port=8080):
     """Run HTTP server with restart on failure"""
     while True:
         try:
             server_address = ('0.0.0.0', port)
-            httpd = HTTPServer(server_address, HealthCheckHandler)
+            httpd = ThreadingHTTPServer(server_address, HealthCheckHandler)
+            httpd.daemon_threads = True
             httpd.start_time = time.time()
             logger.info(f"HTTP server running on port {port}")
             httpd.serve_forever()
@@ -149,7 +1431,8 @@ def run_http_server(port=8080):
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    premium = is_premium(user_id)
+    user_writes.touch(user_id)
+    sub = await user_context(update, context).subscription()
     
     welcome_msg = (
         "🌟 *Welcome to Quiz Bot!* 🌟\n\n"
@@ -159,8 +1442,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "🔹 Use /about - Bot information\n\n"
     )
     
-    if premium:
-        sub = premium_subscriptions.find_one({'user_id': user_id})
+    if sub:
         expires = sub['expires_at'].strftime('%Y-%m-%d')
         welcome_msg += f"🎉 *PREMIUM USER* (Expires: {expires}) 🎉\nNo limits!\n\n"
     else:
@@ -221,7 +1503,7 @@ async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     is_owner = user_id == OWNER_ID
-    premium = is_premium(user_id)
+    premium = await user_context(update, context).premium()
     
     help_text = (
         "📝 *Quiz File Format Guide:*\n\n"
@@ -245,6 +1527,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "• Exactly 4 options (any prefix format accepted)\n"
         "• Answer format: 'Answer: <1-4>' (1=first option, 2=second, etc.)\n"
         "• Optional 7th line for explanation (any text)\n\n"
+        "📊 *CSV/TSV:* columns `question, option1..option4, answer, explanation`\n"
+        "🧩 *JSON/JSONL:* `{\"question\": ..., \"options\": [...], \"answer\": 2}`\n\n"
     )
     
     if premium:
@@ -263,8 +1547,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "/add <user_id> <duration> - Grant premium\n"
             "/rem <user_id> - Revoke premium\n"
             "/broadcast <message> - Broadcast to all users\n"
+            "/queue - Show queued jobs and delivery speed\n"
         )
     
+    help_text += "🔹 Use /myquizzes - Replay quizzes you uploaded before\n"
+    help_text += "🔹 Use /stop - Cancel the quiz being sent\n"
+    help_text += "🔹 Use /leaderboard or /myscore - See quiz rankings\n"
     help_text += "🔹 Use /myplan - Check your premium status\n"
     help_text += "🔹 Use /plans - See available premium plans"
     
@@ -272,20 +1560,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 async def create_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    premium = is_premium(user_id)
-    user = get_user_data(user_id)
+    account = user_context(update, context)
+    user_writes.touch(user_id)
     
-    if not premium:
-        current_time = time.time()
-        last_time = user.get('last_quiz_time', 0)
-        time_diff = (current_time - last_time) / 60
+    if not await account.premium():
+        remaining, retry_after = await account.free_quota()
         
-        if time_diff >= COOLDOWN_MINUTES:
-            update_user_data(user_id, {'quiz_count': 0, 'last_quiz_time': current_time})
-            user['quiz_count'] = 0
-        
-        if user['quiz_count'] >= FREE_USER_LIMIT:
-            remaining_time = COOLDOWN_MINUTES - int(time_diff)
+        if remaining <= 0:
+            remaining_time = max(1, -(-retry_after // 60))
             await update.message.reply_text(
                 f"⏳ You've reached your free limit of {FREE_USER_LIMIT} questions.\n"
                 f"Please wait {remaining_time} minutes or upgrade to /upgrade",
@@ -295,7 +1577,7 @@ async def create_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     
     await update.message.reply_text(
         "📤 *Ready to create your quiz!*\n\n"
-        "Please send me a .txt file containing your questions.\n\n"
+        "Please send me a .txt, .csv or .json file containing your questions.\n\n"
         "Need format help? Use /help",
         parse_mode='Markdown'
     )
@@ -315,7 +1597,7 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     try:
         target_id = int(context.args[0])
         duration = " ".join(context.args[1:])
-        expires_at = add_premium_subscription(target_id, duration)
+        expires_at = await add_premium_subscription(target_id, duration)
         
         # Get current time in UTC
         now = datetime.utcnow()
@@ -367,9 +1649,9 @@ async def rem_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     
     try:
         target_id = int(context.args[0])
-        result = premium_subscriptions.delete_one({'user_id': target_id})
+        removed = await remove_premium_subscription(target_id)
         
-        if result.deleted_count > 0:
+        if removed:
             removal_msg = (
                 "👋 ʜᴇʏ,\n\n"
                 "Your premium subscription has been removed.\n"
@@ -394,11 +1676,9 @@ async def rem_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 async def upgrade_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id
-    premium = is_premium(user_id)
+    sub = await user_context(update, context).subscription()
     
-    if premium:
-        sub = premium_subscriptions.find_one({'user_id': user_id})
+    if sub:
         expires = sub['expires_at'].strftime('%d-%m-%Y')
         await update.message.reply_text(
             f"🎉 You're a premium user! (Expires: {expires})\n"
@@ -433,44 +1713,102 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text("❌ Owner only command!")
         return
     
-    total_users = users.count_documents({})
-    active_premium = premium_subscriptions.count_documents({
-        'expires_at': {'$gt': datetime.utcnow()}
-    })
-    
-    active_today = users.count_documents({
-        'last_quiz_time': {'$gt': time.time() - 86400}
-    })
+    if context.args and context.args[0] == 'history':
+        await stats_history(update)
+        return
     
-    total_quizzes = users.aggregate([
-        {'$group': {'_id': None, 'total': {'$sum': '$quiz_count'}}}
-    ])
-    total_quiz_count = next(total_quizzes, {}).get('total', 0)
+    bot_stats = await run_db(get_bot_stats)
+    totals, today = bot_stats['totals'], bot_stats['today']
+    cache = premium_cache.stats()
+    sends = outbound.stats()
+    quizzes = parsed_quiz_cache.stats()
     
     stats_msg = (
         "📊 *Bot Statistics*\n\n"
-        f"• Total Users: `{total_users}`\n"
-        f"• Active Premium: `{active_premium}`\n"
-        f"• Active Today: `{active_today}`\n"
-        f"• Free Quizzes Generated: `{total_quiz_count}`\n\n"
+        f"• Total Users: `{totals.get('new_users', 0)}`\n"
+        f"• Active Premium: `{bot_stats['active_premium']}` "
+        f"(`{today.get('premium_expired', 0)}` expired today)\n"
+        f"• Active Today: `{today.get('active_users', 0)}`\n"
+        f"• New Users Today: `{today.get('new_users', 0)}`\n"
+        f"• Questions Sent: `{today.get('questions_sent', 0)}` today, "
+        f"`{totals.get('questions_sent', 0)}` total\n"
+        f"• Premium Cache: `{cache['hits']}` hits / `{cache['misses']}` misses "
+        f"(`{cache['hit_rate']:.0%}`)\n"
+        f"• Quiz Cache: `{quizzes['memory_hits']}` memory / `{quizzes['mongo_hits']}` mongo hits, "
+        f"`{quizzes['misses']}` misses (`{quizzes['hit_rate']:.0%}`)\n"
+        f"• Outbound Queue: `{sends['queued']}` waiting, `{sends['sent']}` sent, "
+        f"avg wait `{sends['avg_wait_ms']:.0f}` ms, `{sends['retry_after']}` flood waits\n\n"
         "👑 Owner Commands:\n"
         "`/add <user_id> <duration>` - Add premium\n"
         "`/rem <user_id>` - Remove premium\n"
         "`/broadcast <message>` - Broadcast to all users\n"
+        "`/stats history` - Daily figures for the last 30 days\n"
     )
     
     await update.message.reply_text(stats_msg, parse_mode='Markdown')
 
-def parse_quiz_file(content: str) -> tuple:
-    blocks = [b.strip() for b in content.split('\n\n') if b.strip()]
-    valid_questions = []
-    errors = []
+async def stats_history(update: Update) -> None:
+    rollups = await run_db(get_stats_history)
+    if not rollups:
+        await update.message.reply_text("ℹ️ No statistics recorded yet")
+        return
     
-    for i, block in enumerate(blocks):
-        lines = [line.strip() for line in block.split('\n') if line.strip()]
-        
+    lines = ["Date        New  Active  Quizzes  Questions"]
+    for doc in rollups:
+        lines.append(
+            f"{doc['_id']}  {doc.get('new_users', 0):>4}  {doc.get('active_users', 0):>6}  "
+            f"{doc.get('quizzes', 0):>7}  {doc.get('questions_sent', 0):>9}"
+        )
+    await update.message.reply_text(
+        f"📈 *Last {STATS_HISTORY_DAYS} days*\n\n```\n" + "\n".join(lines) + "\n```",
+        parse_mode='Markdown'
+    )
+
+def iter_decoded_lines(data, encoding: str = 'utf-8-sig', chunk_size: int = 64 * 1024,
+                       errors: str = 'strict', keepends: bool = False, max_line: int = None):
+    """Incrementally decode a bytes-like object and yield its lines.
+    
+    With `max_line`, a line longer than that is yielded in pieces as it is
+    decoded, so a minified single-line file never sits in memory as a whole.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    view = memoryview(data)
+    pending = ''
+    end = '\n' if keepends else ''
+    for start in range(0, len(view), chunk_size):
+        lines = (pending + decoder.decode(view[start:start + chunk_size])).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + end
+        if max_line and len(pending) >= max_line:
+            yield pending
+            pending = ''
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+def iter_quiz_blocks(lines):
+    """Group lines into blank-line separated blocks of stripped, non-empty lines"""
+    block = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def iter_quiz_questions(source_lines):
+    """Lazily parse quiz blocks, yielding (question, error) pairs.
+    
+    Exactly one element of each pair is set. Questions are
+    (question, options, correct_id, explanation) tuples.
+    """
+    for i, lines in enumerate(iter_quiz_blocks(source_lines)):
         if len(lines) not in (6, 7):
-            errors.append(f"❌ Question {i+1}: Invalid line count ({len(lines)}), expected 6 or 7")
+            yield None, f"❌ Question {i+1}: Invalid line count ({len(lines)}), expected 6 or 7"
             continue
             
         question = lines[0]
@@ -491,92 +1829,865 @@ def parse_quiz_file(content: str) -> tuple:
                 answer_error = "Malformed answer line"
         
         if answer_error:
-            errors.append(f"❌ Q{i+1}: {answer_error}")
+            yield None, f"❌ Q{i+1}: {answer_error}"
         else:
-            option_texts = options
-            correct_id = int(answer_line.split(':')[1].strip()) - 1
-            valid_questions.append((question, option_texts, correct_id, explanation))
-    
+            yield (question, options, answer_num - 1, explanation), None
+
+# Telegram's quiz poll limits
+POLL_QUESTION_MAX = 300
+POLL_OPTION_MAX = 100
+POLL_OPTIONS_MIN = 2
+POLL_OPTIONS_MAX = 10
+POLL_EXPLANATION_MAX = 200
+POLL_EXPLANATION_MAX_LINE_FEEDS = 2
+MESSAGE_MAX = 4096
+
+def explanation_fits_poll(explanation: str) -> bool:
+    return (len(explanation) <= POLL_EXPLANATION_MAX
+            and explanation.count('\n') <= POLL_EXPLANATION_MAX_LINE_FEEDS)
+
+def shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+def normalize_question(question: tuple) -> tuple:
+    """Check a parsed question against Telegram's poll limits before sending.
+    
+    Returns (question, error, fixes): the question to send (or None when it
+    can't be sent) and notes about the safe automatic fixes applied.
+    """
+    text, options, correct_id, explanation = question
+    text = text.strip()
+    if not text:
+        return None, "Question is empty", []
+    if len(text) > POLL_QUESTION_MAX:
+        return None, f"Question is {len(text)} characters, the limit is {POLL_QUESTION_MAX}", []
+    if not 0 <= correct_id < len(options):
+        return None, f"Answer {correct_id + 1} is out of range", []
+    
+    fixes = []
+    cleaned = []
+    for i, option in enumerate(options):
+        option = option.strip()
+        if len(option) > POLL_OPTION_MAX:
+            option = shorten(option, POLL_OPTION_MAX)
+            fixes.append(f"option {i + 1} shortened to {POLL_OPTION_MAX} characters")
+        cleaned.append(option)
+    correct = cleaned[correct_id]
+    if not correct:
+        return None, f"The correct option ({correct_id + 1}) is empty", []
+    if cleaned.count(correct) > 1:
+        return None, "The correct answer appears in more than one option", []
+    
+    # Dropping other empty or repeated options can't change the answer
+    kept = []
+    for i, option in enumerate(cleaned):
+        if i != correct_id and not option:
+            fixes.append(f"empty option {i + 1} removed")
+        elif i != correct_id and option in kept:
+            fixes.append(f"duplicate option {i + 1} removed")
+        else:
+            kept.append(option)
+    
+    if not POLL_OPTIONS_MIN <= len(kept) <= POLL_OPTIONS_MAX:
+        return None, f"Needs {POLL_OPTIONS_MIN}-{POLL_OPTIONS_MAX} options, got {len(kept)}", []
+    
+    explanation = (explanation or '').strip() or None
+    if explanation and not explanation_fits_poll(explanation):
+        if len(explanation) > MESSAGE_MAX - 100:
+            explanation = shorten(explanation, MESSAGE_MAX - 100)
+        fixes.append("long explanation will follow the poll as a separate message")
+    return (text, kept, kept.index(correct), explanation), None, fixes
+
+def collect_quiz_questions(results) -> tuple:
+    """Split (question, error) pairs into (valid_questions, errors).
+    
+    Parsed questions are also validated against Telegram's poll limits, so
+    nothing that would fail in send_poll is returned. Auto-fixes are
+    reported in `errors` with a 🛠 prefix next to the ❌ rejections.
+    """
+    valid_questions = []
+    errors = []
+    for i, (question, error) in enumerate(results):
+        if error:
+            errors.append(error)
+            continue
+        question, error, fixes = normalize_question(question)
+        if error:
+            errors.append(f"❌ Q{i+1}: {error}")
+        else:
+            valid_questions.append(question)
+            if fixes:
+                errors.append(f"🛠 Q{i+1}: {', '.join(fixes)}")
     return valid_questions, errors
 
+def parse_quiz_file(content: str) -> tuple:
+    return collect_quiz_questions(iter_quiz_questions(io.StringIO(content)))
+
+def detect_encoding(head: bytes) -> str:
+    """Guess the text encoding of a file from its first bytes"""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    # BOM-less UTF-16 puts a NUL next to every ASCII character
+    sample = head[:4096]
+    if sample and sample.count(0) > len(sample) // 4:
+        zeros_at_odd = sample[1::2].count(0)
+        return 'utf-16-le' if zeros_at_odd > sample[0::2].count(0) else 'utf-16-be'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        # Spreadsheet exports on Windows default to cp1252
+        return 'cp1252'
+
+def parse_quiz_bytes(data, importer=None) -> tuple:
+    """Parse an uploaded file straight from memory without decoding it all at once"""
+    importer = importer or quiz_importers['.txt']
+    encoding = detect_encoding(bytes(memoryview(data)[:64 * 1024]))
+    lines = iter_decoded_lines(
+        data, encoding, errors='replace', keepends=importer.keepends, max_line=importer.max_line
+    )
+    return collect_quiz_questions(importer.parse(lines))
+
+# Quiz importers
+# Each importer turns decoded lines into the same (question, error) pairs as
+# iter_quiz_questions, one row or object at a time, so large exports never
+# have to be materialised as a whole.
+class QuizImporter:
+    def __init__(self, name: str, parse, extensions: tuple, mime_types: tuple = (), keepends: bool = False,
+                 max_line: int = None):
+        self.name = name
+        self.parse = parse
+        self.extensions = extensions
+        self.mime_types = mime_types
+        self.keepends = keepends
+        self.max_line = max_line  # split longer lines; only for formats that don't care about line breaks
+
+quiz_importers = {}
+quiz_importers_by_mime = {}
+
+def register_importer(importer: QuizImporter) -> QuizImporter:
+    for extension in importer.extensions:
+        quiz_importers[extension] = importer
+    for mime_type in importer.mime_types:
+        quiz_importers_by_mime[mime_type] = importer
+    return importer
+
+def quiz_document_filter():
+    """Match documents some registered importer can read, by extension or MIME type"""
+    parts = [filters.Document.FileExtension(extension.lstrip('.')) for extension in quiz_importers]
+    parts += [filters.Document.MimeType(mime_type) for mime_type in quiz_importers_by_mime]
+    return functools.reduce(lambda a, b: a | b, parts)
+
+def find_importer(file_name: str, mime_type: str = None):
+    """Pick an importer by file extension, falling back to the MIME type"""
+    extension = os.path.splitext(file_name or '')[1].lower()
+    return quiz_importers.get(extension) or quiz_importers_by_mime.get((mime_type or '').lower())
+
+ANSWER_LETTERS = 'abcdefghij'
+
+def parse_answer(answer, options: list) -> int:
+    """Resolve a 1-based number, a letter or the option text to a 0-based index"""
+    if isinstance(answer, bool):
+        raise ValueError(f"Invalid answer {answer}")
+    if isinstance(answer, int):
+        index = answer - 1
+    else:
+        text = str(answer).strip()
+        if text.lower().startswith('answer:'):
+            text = text[7:].strip()
+        if text.isdigit():
+            index = int(text) - 1
+        elif len(text) == 1 and text.lower() in ANSWER_LETTERS:
+            index = ANSWER_LETTERS.index(text.lower())
+        elif text in options:
+            index = options.index(text)
+        else:
+            raise ValueError(f"Invalid answer {text!r}")
+    if not 0 <= index < len(options):
+        raise ValueError(f"Answer {index + 1} is out of range")
+    return index
+
+def build_question(fields: dict) -> tuple:
+    """Build a question tuple from named fields, raising ValueError if invalid"""
+    question = str(fields.get('question') or '').strip()
+    if not question:
+        raise ValueError("Missing question")
+    # Spreadsheets leave unused option columns empty; drop them after the
+    # answer is resolved so letters and numbers still match the columns
+    columns = [str(o).strip() if o is not None else '' for o in fields.get('options') or []]
+    if fields.get('answer') in (None, ''):
+        raise ValueError("Missing answer")
+    answer = parse_answer(fields['answer'], columns)
+    if not columns[answer]:
+        raise ValueError(f"Answer {answer + 1} points to an empty option")
+    options = [o for o in columns if o]
+    if len(options) < 2:
+        raise ValueError(f"Needs at least 2 options, got {len(options)}")
+    explanation = str(fields.get('explanation') or '').strip() or None
+    return question, options, options.index(columns[answer]), explanation
+
+def _header_columns(row: list) -> dict:
+    """Map field names to column indexes if `row` is a header, else return None"""
+    names = [cell.strip().lower().replace(' ', '_') for cell in row]
+    if 'question' not in names:
+        return None
+    columns = {'options': []}
+    for index, name in enumerate(names):
+        if name in ('question', 'answer', 'explanation'):
+            columns[name] = index
+        elif re.fullmatch(r'(option_?)?([a-j]|\d+)', name):
+            columns['options'].append(index)
+    return columns
+
+def iter_table_questions(lines, delimiter: str):
+    """Parse CSV/TSV rows: a header naming the columns, or the .txt order
+    (question, 4 options, answer, optional explanation)."""
+    columns = None
+    reader = csv.reader(lines, delimiter=delimiter)
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if columns is None:
+            columns = _header_columns(row)
+            if columns is not None:
+                continue
+            columns = {'question': 0, 'options': [1, 2, 3, 4], 'answer': 5, 'explanation': 6}
+        
+        def cell(index):
+            return row[index] if index is not None and index < len(row) else None
+        
+        try:
+            yield build_question({
+                'question': cell(columns.get('question')),
+                'options': [cell(i) or '' for i in columns['options']],
+                'answer': cell(columns.get('answer')),
+                'explanation': cell(columns.get('explanation'))
+            }), None
+        except ValueError as e:
+            yield None, f"❌ Row {reader.line_num}: {e}"
+
+JSON_SEPARATORS = re.compile(r'[ \t\r\n,\[\]]*')
+
+def iter_json_values(chunks, max_buffer: int = 1024 * 1024, compact_at: int = 64 * 1024):
+    """Yield (value, error) for each JSON value in a JSON array or JSON Lines stream.
+    
+    Values are decoded in place at an offset into the buffer; the consumed
+    prefix is only cut off once it passes `compact_at`, so a long minified
+    array is parsed in linear time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    chunks = iter(chunks)
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        if chunk is None:
+            final = True
+        else:
+            if pos > compact_at:
+                buffer, pos = buffer[pos:], 0
+            buffer += chunk
+        while True:
+            pos = JSON_SEPARATORS.match(buffer, pos).end()
+            if pos >= len(buffer):
+                break
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if final or len(buffer) - pos > max_buffer:
+                    yield None, f"Invalid JSON: {e.msg}"
+                    return
+                break  # most likely a value split across chunks, read more
+            if end == len(buffer) and not final and isinstance(value, (int, float)):
+                break  # a number may continue in the next chunk
+            yield value, None
+            pos = end
+
+def _json_question(value) -> tuple:
+    if not isinstance(value, dict):
+        raise ValueError("Expected an object")
+    return build_question(value)
+
+def iter_json_questions(lines):
+    """Parse an array of {"question", "options": [...], "answer", "explanation"} objects"""
+    for i, (value, error) in enumerate(iter_json_values(lines)):
+        if error:
+            yield None, f"❌ Item {i+1}: {error}"
+            return
+        try:
+            yield _json_question(value), None
+        except ValueError as e:
+            yield None, f"❌ Item {i+1}: {e}"
+
+def iter_jsonl_questions(lines):
+    """Parse one question object per line; a bad line doesn't stop the rest"""
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            yield _json_question(json.loads(line)), None
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too
+            yield None, f"❌ Line {i+1}: {e}"
+
+register_importer(QuizImporter('txt', iter_quiz_questions, ('.txt',), ('text/plain',)))
+register_importer(QuizImporter(
+    'csv', lambda lines: iter_table_questions(lines, ','),
+    ('.csv',), ('text/csv', 'application/vnd.ms-excel'), keepends=True
+))
+register_importer(QuizImporter(
+    'tsv', lambda lines: iter_table_questions(lines, '\t'),
+    ('.tsv', '.tab'), ('text/tab-separated-values',), keepends=True
+))
+register_importer(QuizImporter(
+    'json', iter_json_questions, ('.json',), ('application/json',), keepends=True, max_line=64 * 1024
+))
+register_importer(QuizImporter(
+    'jsonl', iter_jsonl_questions, ('.jsonl', '.ndjson'), ('application/x-ndjson', 'application/jsonl')
+))
+
+class ParsedQuizCache:
+    """Two-tier cache of parsed quiz files.
+    
+    Entries are keyed by the SHA-256 of the file content and also indexed
+    by Telegram's file_unique_id, so a re-upload of the same file skips
+    both the download and the parse. The in-memory tier is an LRU of
+    QUIZ_MEMORY_CACHE_SIZE entries; the Mongo tier stores zlib-compressed
+    JSON and evicts least recently used entries beyond QUIZ_CACHE_MAX_BYTES.
+    A counter document keeps the tier's total size, so the entries are only
+    summed once per process and again when the counter passes the limit.
+    """
+    
+    SIZE_ID = 'size'  # _id of the counter document
+    EVICT_TO = 0.9  # of max_bytes, so a full cache isn't summed again on the next store
+    
+    def __init__(self, collection, maxsize: int, max_bytes: int):
+        self.collection = collection
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._file_ids = {}
+        self._counted = False
+    
+    def _remember(self, digest: str, file_unique_id: str, parsed: tuple) -> None:
+        self._entries[digest] = parsed
+        self._entries.move_to_end(digest)
+        self._file_ids[file_unique_id] = digest
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            self._file_ids = {k: v for k, v in self._file_ids.items() if v != evicted}
+    
+    @staticmethod
+    def _decode(doc: dict) -> tuple:
+        questions, errors = json.loads(zlib.decompress(doc['data']))
+        return [tuple(q) for q in questions], errors
+    
+    def _load(self, query: dict, file_unique_id: str):
+        doc = self.collection.find_one_and_update(
+            {**query, 'version': QUIZ_PARSER_VERSION},
+            {'$set': {'last_used': datetime.utcnow()}, '$addToSet': {'file_ids': file_unique_id}},
+            projection={'data': 1}
+        )
+        return (doc['_id'], self._decode(doc)) if doc else None
+    
+    def _store(self, digest: str, file_unique_id: str, parsed: tuple) -> None:
+        data = zlib.compress(json.dumps(parsed, ensure_ascii=False).encode('utf-8'))
+        if len(data) > QUIZ_CACHE_MAX_ENTRY_BYTES:
+            return
+        previous = self.collection.find_one_and_update(
+            {'_id': digest},
+            {
+                '$set': {
+                    'data': Binary(data), 'size': len(data),
+                    'version': QUIZ_PARSER_VERSION, 'last_used': datetime.utcnow()
+                },
+                '$addToSet': {'file_ids': file_unique_id}
+            },
+            projection={'size': 1},
+            upsert=True
+        )
+        counted = self._add_size(len(data) - (previous or {}).get('size', 0))
+        if counted > self.max_bytes or not self._counted:
+            self._evict(counted)
+    
+    def _add_size(self, delta: int) -> int:
+        doc = self.collection.find_one_and_update(
+            {'_id': self.SIZE_ID}, {'$inc': {'size': delta}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc['size']
+    
+    def _evict(self, counted: int) -> None:
+        """Sum the entries, evict down to max_bytes and correct the counter"""
+        entries = {'_id': {'$ne': self.SIZE_ID}}
+        total = next(self.collection.aggregate([
+            {'$match': entries},
+            {'$group': {'_id': None, 'size': {'$sum': '$size'}}}
+        ]), {}).get('size', 0)
+        self._counted = True
+        stale = []
+        if total > self.max_bytes:
+            target = self.max_bytes * self.EVICT_TO
+            for doc in self.collection.find(entries, {'size': 1}).sort('last_used', 1):
+                if total <= target:
+                    break
+                stale.append(doc['_id'])
+                total -= doc['size']
+            self.collection.delete_many({'_id': {'$in': stale}})
+        # Relative, so stores by other workers since `counted` aren't lost
+        if total != counted:
+            self._add_size(total - counted)
+    
+    async def get_by_file(self, file_unique_id: str):
+        """Look up a file by Telegram's file_unique_id without downloading it"""
+        digest = self._file_ids.get(file_unique_id)
+        if digest in self._entries:
+            self._entries.move_to_end(digest)
+            self.memory_hits += 1
+            return self._entries[digest]
+        
+        found = await run_db(self._load, {'file_ids': file_unique_id}, file_unique_id)
+        if found:
+            self.mongo_hits += 1
+            digest, parsed = found
+            self._remember(digest, file_unique_id, parsed)
+            return parsed
+        return None
+    
+    async def get_by_hash(self, digest: str, file_unique_id: str):
+        """Look up downloaded content by hash, e.g. the same file forwarded under a new id"""
+        if digest in self._entries:
+            self.memory_hits += 1
+            self._remember(digest, file_unique_id, self._entries[digest])
+            await run_db(
+                self.collection.update_one,
+                {'_id': digest}, {'$addToSet': {'file_ids': file_unique_id}}
+            )
+            return self._entries[digest]
+        
+        found = await run_db(self._load, {'_id': digest}, file_unique_id)
+        if found:
+            self.mongo_hits += 1
+            self._remember(digest, file_unique_id, found[1])
+            return found[1]
+        self.misses += 1
+        return None
+    
+    async def put(self, digest: str, file_unique_id: str, parsed: tuple) -> None:
+        self._remember(digest, file_unique_id, parsed)
+        try:
+            await run_db(self._store, digest, file_unique_id, parsed)
+        except Exception as e:
+            logger.warning(f"Couldn't store parsed quiz {digest}: {e}")
+    
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.mongo_hits
+        lookups = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'mongo_hits': self.mongo_hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0
+        }
+
+parsed_quiz_cache = ParsedQuizCache(quiz_cache, QUIZ_MEMORY_CACHE_SIZE, QUIZ_CACHE_MAX_BYTES)
+
+async def load_quiz_document(bot, document, importer=None) -> tuple:
+    """Return (valid_questions, errors) for an uploaded document, using the cache"""
+    importer = importer or find_importer(document.file_name, getattr(document, 'mime_type', None))
+    parsed = await parsed_quiz_cache.get_by_file(document.file_unique_id)
+    if parsed is not None:
+        return parsed
+    
+    file = await bot.get_file(document.file_id)
+    data = await file.download_as_bytearray()
+    
+    # Hashing and parsing big files is CPU bound, keep it off the event loop
+    loop = asyncio.get_running_loop()
+    digest = await loop.run_in_executor(None, lambda: hashlib.sha256(data).hexdigest())
+    if importer.name != 'txt':
+        # The same bytes parse differently under another importer
+        digest = f"{importer.name}:{digest}"
+    parsed = await parsed_quiz_cache.get_by_hash(digest, document.file_unique_id)
+    if parsed is None:
+        parsed = await loop.run_in_executor(None, parse_quiz_bytes, data, importer)
+        await parsed_quiz_cache.put(digest, document.file_unique_id, parsed)
+    return parsed
+
+# Quiz library
+def pack_questions(questions: list) -> bytes:
+    """Encode validated questions as compact zlib-compressed JSON"""
+    return zlib.compress(json.dumps(questions, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+def unpack_questions(data: bytes) -> list:
+    return [tuple(q) for q in json.loads(zlib.decompress(data))]
+
+def _save_to_library(user_id: int, name: str, questions: list):
+    data = pack_questions(questions)
+    if len(data) > LIBRARY_MAX_BYTES:
+        return None
+    digest = hashlib.sha256(data).hexdigest()
+    
+    existing = quiz_library.find_one_and_update(
+        {'user_id': user_id, 'hash': digest},
+        {'$set': {'last_used': datetime.utcnow(), 'updated_at': datetime.utcnow()}},
+        projection={'number': 1}
+    )
+    if existing:
+        return existing['number']
+    
+    now = time.time()
+    update = {
+        '$inc': {'library_seq': 1},
+        '$set': {'updated_at': datetime.utcnow()},
+        '$setOnInsert': {'quiz_count': 0, 'last_quiz_time': 0, 'first_seen': now}
+    }
+    try:
+        counter = users.find_one_and_update(
+            {'user_id': user_id}, update,
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race for a brand new user; the document exists now
+        counter = users.find_one_and_update(
+            {'user_id': user_id}, update,
+            return_document=ReturnDocument.AFTER
+        )
+    if counter.get('first_seen') == now:
+        try:
+            _record_event(new_users=1)
+        except Exception as e:
+            logger.warning(f"Couldn't record new user {user_id}: {e}")
+    number = counter['library_seq']
+    quiz_library.insert_one({
+        'user_id': user_id,
+        'number': number,
+        'name': name,
+        'hash': digest,
+        'question_count': len(questions),
+        'questions': Binary(data),
+        'created_at': datetime.utcnow(),
+        'last_used': datetime.utcnow(),
+        'updated_at': datetime.utcnow()
+    })
+    
+    # Numbers only grow, so a user can't be over the cap before this many saves
+    if number > LIBRARY_MAX_QUIZZES:
+        excess = quiz_library.count_documents({'user_id': user_id}) - LIBRARY_MAX_QUIZZES
+        if excess > 0:
+            stale = quiz_library.find({'user_id': user_id}, {'_id': 1}).sort('last_used', 1).limit(excess)
+            quiz_library.delete_many({'_id': {'$in': [doc['_id'] for doc in stale]}})
+    return number
+
+async def save_to_library(user_id: int, name: str, questions: list):
+    """Store a parsed quiz for replay; returns its per-user number, or None if too big"""
+    return await run_db(_save_to_library, user_id, name, questions)
+
+async def list_library(user_id: int, page: int) -> tuple:
+    """Return (quizzes on the page, total quizzes) using the (user_id, number) index"""
+    def query():
+        total = quiz_library.count_documents({'user_id': user_id})
+        cursor = quiz_library.find(
+            {'user_id': user_id},
+            {'_id': 0, 'number': 1, 'name': 1, 'question_count': 1, 'created_at': 1}
+        ).sort('number', -1).skip((page - 1) * LIBRARY_PAGE_SIZE).limit(LIBRARY_PAGE_SIZE)
+        return list(cursor), total
+    return await run_db(query)
+
+async def load_from_library(user_id: int, number: int):
+    doc = await run_db(
+        quiz_library.find_one_and_update,
+        {'user_id': user_id, 'number': number},
+        {'$set': {'last_used': datetime.utcnow(), 'updated_at': datetime.utcnow()}},
+        projection={'name': 1, 'questions': 1}
+    )
+    if not doc:
+        return None
+    return doc['name'], unpack_questions(doc['questions'])
+
+async def delete_from_library(user_id: int, number: int) -> bool:
+    result = await run_db(quiz_library.delete_one, {'user_id': user_id, 'number': number})
+    return result.deleted_count > 0
+
+async def send_quiz_poll(bot, chat_id: int, question: tuple) -> bool:
+    """Send one quiz poll (and its long explanation, if any); return whether it went out"""
+    text, options, correct_id, explanation = question
+    try:
+        poll_params = {
+            "chat_id": chat_id,
+            "question": text,
+            "options": options,
+            "type": 'quiz',
+            "correct_option_id": correct_id,
+            "is_anonymous": False,
+            "open_period": 10
+        }
+        
+        follow_up = None
+        if explanation and explanation_fits_poll(explanation):
+            poll_params["explanation"] = explanation
+        elif explanation:
+            # Too long for the poll; send it hidden so it doesn't give the answer away
+            follow_up = f"💡 <b>Explanation:</b> <tg-spoiler>{html.escape(explanation)}</tg-spoiler>"
+        
+        message = await bot.send_poll(**poll_params)
+        poll_registry.add(message.poll.id, chat_id, correct_id)
+        if follow_up:
+            await bot.send_message(chat_id=chat_id, text=follow_up, parse_mode='HTML')
+        return True
+    except Exception as e:
+        logger.error(f"Poll send error: {str(e)}")
+        try:
+            await bot.send_message(chat_id=chat_id, text="⚠️ Failed to send one quiz. Continuing...")
+        except Exception as notice_error:
+            logger.warning(f"Couldn't report the failed poll to {chat_id}: {notice_error}",
+                           extra={'log_key': 'poll_failure_notice'})
+        return False
+
+class FairSlots:
+    """A semaphore that hands freed slots to waiting keys in round-robin order.
+    
+    Every delivery waits for a slot before each poll, keyed by its user, so
+    a 2,000-question upload gets one turn per round like everyone else
+    instead of holding the sender until it is done.
+    """
+    
+    def __init__(self, size: int):
+        self.size = size
+        self.free = size
+        self._waiters = OrderedDict()  # key -> deque of futures, in turn order
+    
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+    
+    def _release(self) -> None:
+        while self._waiters:
+            key, queue = self._waiters.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                self._waiters[key] = queue  # back of the line
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+    
+    @contextlib.asynccontextmanager
+    async def turn(self, key):
+        if self.free and not self._waiters:
+            self.free -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(key, deque()).append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()  # we were handed a slot just as we were cancelled
+                else:
+                    queue = self._waiters.get(key)
+                    if queue and future in queue:
+                        queue.remove(future)
+                        if not queue:
+                            del self._waiters[key]
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+delivery_slots = FairSlots(DELIVERY_CONCURRENCY)
+active_deliveries = {}  # job_id -> delivery state, for /stop and /queue
+
+def _delivery_progress_text(delivery: dict) -> str:
+    sent, total = delivery['sent'], delivery['total']
+    if delivery['cancelled']:
+        line = f"🛑 Stopped after {sent}/{total} questions"
+    elif delivery['position'] >= total:
+        line = f"✅ Sent {sent}/{total} questions"
+    else:
+        line = f"📤 Progress: {sent}/{total} · /stop to cancel"
+    return f"{delivery['status_text']}\n\n{line}" if delivery['status_text'] else line
+
+def _save_delivery_progress(job: dict, delivery: dict):
+    """Store the next question index on the job and return its cancel flag (blocking, call through run_db).
+    
+    Only the worker holding the claim may write, so a worker that lost its
+    job can't move a resumed delivery's position backwards.
+    """
+    return jobs.find_one_and_update(
+        {'_id': job['_id'], 'owner': job.get('owner')},
+        {'$set': {'progress': {
+            'sent': delivery['sent'], 'position': delivery['position'],
+            'started_at': delivery['started_at'], 'updated_at': datetime.utcnow()
+        }}},
+        projection={'cancel_requested': 1}
+    )
+
+async def _delivery_checkpoint(bot, job: dict, delivery: dict) -> None:
+    """Sync progress/cancellation with the job document, then edit the progress message"""
+    doc = await run_db(_save_delivery_progress, job, delivery)
+    if doc and doc.get('cancel_requested'):
+        delivery['cancelled'] = True
+    if delivery['message_id']:
+        # Cosmetic: a failed edit must not cost the delivery its checkpoint
+        try:
+            await bot.edit_message_text(
+                chat_id=job['chat_id'], message_id=delivery['message_id'],
+                text=_delivery_progress_text(delivery)
+            )
+        except BadRequest as e:
+            logger.debug(f"Progress edit skipped: {e}")
+        except Exception as e:
+            logger.warning(f"Couldn't edit delivery progress for {job['_id']}: {e}",
+                           extra={'log_key': 'progress_edit'})
+
+async def deliver_quiz(bot, job: dict) -> int:
+    """Send a queued quiz poll by poll through the fair slots; return how many went out.
+    
+    Starts from the job's last checkpoint, so a delivery handed back at
+    shutdown or reclaimed from a dead worker continues where it stopped.
+    """
+    questions = unpack_questions(job['questions'])
+    progress = job.get('progress') or {}
+    delivery = {
+        'job_id': job['_id'], 'user_id': job['user_id'], 'chat_id': job['chat_id'],
+        'total': len(questions), 'sent': progress.get('sent', 0), 'position': progress.get('position', 0),
+        'cancelled': False, 'stopping': False,
+        'started_at': progress.get('started_at') or datetime.utcnow(),
+        'message_id': job.get('progress_message_id'), 'status_text': job.get('status_text', '')
+    }
+    if delivery['position']:
+        logger.info(f"Resuming delivery {job['_id']} at question {delivery['position'] + 1}/{delivery['total']}")
+    active_deliveries[job['_id']] = delivery
+    last_checkpoint = time.monotonic()
+    try:
+        while delivery['position'] < delivery['total'] and not delivery['cancelled']:
+            async with delivery_slots.turn(job['user_id']):
+                if delivery['stopping']:
+                    break
+                if await send_quiz_poll(bot, job['chat_id'], questions[delivery['position']]):
+                    delivery['sent'] += 1
+            delivery['position'] += 1
+            
+            if (delivery['position'] % DELIVERY_PROGRESS_EVERY == 0
+                    or time.monotonic() - last_checkpoint >= DELIVERY_PROGRESS_INTERVAL):
+                await _delivery_checkpoint(bot, job, delivery)
+                last_checkpoint = time.monotonic()
+    except asyncio.CancelledError:
+        # Cut off mid-poll: keep the position of the last poll known to be sent
+        await run_db(_save_delivery_progress, job, delivery)
+        raise
+    except Exception as e:
+        # The job will be retried: keep the position so it neither resends nor skips polls
+        try:
+            await run_db(_save_delivery_progress, job, delivery)
+        except Exception as save_error:
+            logger.warning(f"Couldn't checkpoint delivery {job['_id']} after {e}: {save_error}")
+        raise
+    finally:
+        active_deliveries.pop(job['_id'], None)
+    
+    if delivery['stopping'] and delivery['position'] < delivery['total']:
+        await run_db(_save_delivery_progress, job, delivery)
+        raise JobReleased(f"stopped at question {delivery['position']}/{delivery['total']}")
+    await _delivery_checkpoint(bot, job, delivery)
+    return delivery['sent']
+
+def stop_deliveries() -> None:
+    """Ask running deliveries to stop after their current poll, for a graceful shutdown"""
+    for delivery in active_deliveries.values():
+        delivery['stopping'] = True
+
+async def cancel_deliveries(chat_id: int, user_id: int = None) -> int:
+    """Stop queued and running deliveries to a chat (only `user_id`'s, if given)"""
+    query = {'kind': 'quiz_delivery', 'chat_id': chat_id}
+    if user_id is not None:
+        query['user_id'] = user_id
+    for delivery in active_deliveries.values():
+        if delivery['chat_id'] == chat_id and user_id in (None, delivery['user_id']):
+            delivery['cancelled'] = True
+    queued = await run_db(
+        jobs.update_many, {**query, 'status': 'pending'},
+        {'$set': {'status': 'cancelled', 'finished_at': datetime.utcnow()}, '$unset': {'questions': ''}}
+    )
+    # Deliveries running on other replicas see this at their next checkpoint
+    running = await run_db(
+        jobs.update_many, {**query, 'status': 'running'}, {'$set': {'cancel_requested': True}}
+    )
+    return queued.modified_count + running.modified_count
+
+async def enqueue_quiz_delivery(user_id: int, chat_id: int, questions: list, status_message=None) -> ObjectId:
+    """Hand a quiz to the job queue; any worker may deliver it.
+    
+    `status_message` is the reply announcing the quiz; the delivery edits it
+    to show its progress.
+    """
+    return await enqueue_job(
+        'quiz_delivery',
+        user_id=user_id,
+        chat_id=chat_id,
+        question_count=len(questions),
+        questions=Binary(pack_questions(questions)),
+        progress_message_id=status_message.message_id if status_message else None,
+        status_text=status_message.text if status_message else ''
+    )
+
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    premium = is_premium(user_id)
-    user = get_user_data(user_id)
+    premium = await user_context(update, context).premium()
     
-    if not update.message.document.file_name.endswith('.txt'):
-        await update.message.reply_text("❌ Please send a .txt file")
+    document = update.message.document
+    importer = find_importer(document.file_name, document.mime_type)
+    if importer is None:
+        await update.message.reply_text("❌ Please send a .txt, .csv, .tsv, .json or .jsonl file")
         return
     
     try:
-        file = await context.bot.get_file(update.message.document.file_id)
-        await file.download_to_drive('quiz.txt')
-        
-        with open('quiz.txt', 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        valid_questions, errors = parse_quiz_file(content)
+        valid_questions, errors = await load_quiz_document(context.bot, document, importer)
         question_count = len(valid_questions)
         
-        if not premium:
-            current_time = time.time()
-            last_time = user.get('last_quiz_time', 0)
-            time_diff = (current_time - last_time) / 60
-            
-            if time_diff >= COOLDOWN_MINUTES:
-                update_user_data(user_id, {'quiz_count': 0, 'last_quiz_time': current_time})
-                user['quiz_count'] = 0
+        if premium:
+            user_writes.touch(user_id)
+        else:
+            accepted, remaining, _ = await consume_quota(user_id, question_count)
             
-            if user['quiz_count'] + question_count > FREE_USER_LIMIT:
-                remaining = FREE_USER_LIMIT - user['quiz_count']
+            if not accepted:
                 await update.message.reply_text(
                     f"⚠️ You can only create {remaining} more questions in this period.\n"
                     f"Upgrade to /upgrade for unlimited access.",
                     parse_mode='Markdown'
                 )
                 return
-            
-            new_count = user['quiz_count'] + question_count
-            update_user_data(user_id, {
-                'quiz_count': new_count,
-                'last_quiz_time': current_time
-            })
         
         if errors:
-            error_msg = "\n".join(errors[:5])
-            if len(errors) > 5:
-                error_msg += f"\n\n...and {len(errors)-5} more errors"
+            # One report for the whole file: rejected questions first, then fixes
+            rejected = [e for e in errors if e.startswith('❌')]
+            fixed = [e for e in errors if not e.startswith('❌')]
+            shown = (rejected + fixed)[:5]
+            error_msg = "\n".join(shown)
+            if len(errors) > len(shown):
+                error_msg += f"\n\n...and {len(errors) - len(shown)} more"
             await update.message.reply_text(
-                f"⚠️ Found {len(errors)} error(s):\n\n{error_msg}"
+                f"⚠️ Skipped {len(rejected)} question(s), auto-fixed {len(fixed)}:\n\n{error_msg}"
             )
         
         if valid_questions:
             status_msg = f"✅ Sending {len(valid_questions)} quiz question(s)..."
             if not premium:
-                remaining = FREE_USER_LIMIT - (user['quiz_count'] if 'quiz_count' in user else 0)
                 status_msg += f"\n\nℹ️ Free questions left: {remaining}"
             
-            await update.message.reply_text(status_msg)
+            number = await save_to_library(user_id, update.message.document.file_name, valid_questions)
+            if number:
+                status_msg += f"\n\n💾 Saved to your library as #{number}. Replay it with /replay {number}"
             
-            for question, options, correct_id, explanation in valid_questions:
-                try:
-                    poll_params = {
-                        "chat_id": update.effective_chat.id,
-                        "question": question,
-                        "options": options,
-                        "type": 'quiz',
-                        "correct_option_id": correct_id,
-                        "is_anonymous": False,
-                        "open_period": 10
-                    }
-                    
-                    if explanation:
-                        poll_params["explanation"] = explanation
-                    
-                    await context.bot.send_poll(**poll_params)
-                except Exception as e:
-                    logger.error(f"Poll send error: {str(e)}")
-                    await update.message.reply_text("⚠️ Failed to send one quiz. Continuing...")
+            status = await update.message.reply_text(status_msg)
+            await enqueue_quiz_delivery(user_id, update.effective_chat.id, valid_questions, status)
         else:
             await update.message.reply_text("❌ No valid questions found in file")
             
@@ -584,12 +2695,190 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.error(f"File processing error: {str(e)}")
         await update.message.reply_text("⚠️ Error processing file. Please check format and try again.")
 
-async def myplan_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def myquizzes_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List the user's saved quizzes"""
     user_id = update.effective_user.id
-    premium = is_premium(user_id)
+    try:
+        page = max(1, int(context.args[0])) if context.args else 1
+    except ValueError:
+        await update.message.reply_text("ℹ️ Usage: /myquizzes [page]")
+        return
     
-    if premium:
-        sub = premium_subscriptions.find_one({'user_id': user_id})
+    quizzes, total = await list_library(user_id, page)
+    if not total:
+        await update.message.reply_text("📚 Your library is empty. Upload a .txt quiz file to save one.")
+        return
+    
+    pages = -(-total // LIBRARY_PAGE_SIZE)
+    if not quizzes:
+        await update.message.reply_text(f"ℹ️ There are only {pages} page(s)")
+        return
+    
+    lines = [f"📚 Your quizzes (page {page}/{pages}):\n"]
+    for quiz in quizzes:
+        created = quiz['created_at'].strftime('%d-%m-%Y')
+        lines.append(f"#{quiz['number']} • {quiz['name']} • {quiz['question_count']} questions • {created}")
+    lines.append("\n🔹 /replay <number> [count] - Send a saved quiz here")
+    lines.append("🔹 /delquiz <number> - Delete a saved quiz")
+    if page < pages:
+        lines.append(f"🔹 /myquizzes {page + 1} - Next page")
+    await update.message.reply_text("\n".join(lines))
+
+async def replay_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a saved quiz to the current chat without re-uploading it"""
+    user_id = update.effective_user.id
+    try:
+        number = int(context.args[0])
+        count = int(context.args[1]) if len(context.args) > 1 else None
+    except (IndexError, ValueError):
+        await update.message.reply_text("ℹ️ Usage: /replay <number> [count]\nSee your quizzes with /myquizzes")
+        return
+    
+    saved = await load_from_library(user_id, number)
+    if not saved:
+        await update.message.reply_text(f"❌ No saved quiz #{number}. See /myquizzes")
+        return
+    name, questions = saved
+    if count is not None and count > 0:
+        questions = questions[:count]
+    
+    status_msg = f"✅ Replaying {name}: {len(questions)} quiz question(s)..."
+    if not await user_context(update, context).premium():
+        accepted, remaining, _ = await consume_quota(user_id, len(questions))
+        if not accepted:
+            hint = f"Use /replay {number} {remaining} or upgrade" if remaining else "Upgrade"
+            await update.message.reply_text(
+                f"⚠️ You can only create {remaining} more questions in this period.\n"
+                f"{hint} to /upgrade for unlimited access."
+            )
+            return
+        status_msg += f"\n\nℹ️ Free questions left: {remaining}"
+    
+    status = await update.message.reply_text(status_msg)
+    await enqueue_quiz_delivery(user_id, update.effective_chat.id, questions, status)
+
+async def delquiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Delete a saved quiz"""
+    user_id = update.effective_user.id
+    try:
+        number = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("ℹ️ Usage: /delquiz <number>")
+        return
+    
+    if await delete_from_library(user_id, number):
+        await update.message.reply_text(f"🗑️ Deleted quiz #{number}")
+    else:
+        await update.message.reply_text(f"❌ No saved quiz #{number}. See /myquizzes")
+
+async def poll_answer_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Score an answer to one of our quiz polls"""
+    answer = update.poll_answer
+    if not answer.option_ids or answer.user is None:
+        return
+    user = answer.user
+    scoreboard.answer(answer.poll_id, user.id, user.username or user.first_name, answer.option_ids[0])
+
+def format_leaderboard(title: str, entries: list, names: dict) -> str:
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [title]
+    for position, (user_id, correct) in enumerate(entries, 1):
+        name = names.get(user_id, str(user_id))
+        lines.append(f"{medals.get(position, f'{position}.')} {name} — {correct}")
+    return "\n".join(lines)
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the top players in this chat, or globally in private chats"""
+    chat = update.effective_chat
+    use_global = chat.type == 'private' or (context.args and context.args[0].lower() == 'global')
+    board = GLOBAL_BOARD if use_global else chat.id
+    entries = await scoreboard.top(board)
+    if not entries:
+        await update.message.reply_text("🏆 No answers yet. Upload a quiz and start answering!")
+        return
+    title = "🏆 Global leaderboard\n" if use_global else "🏆 Leaderboard for this chat\n"
+    names = await scoreboard.display_names([user_id for user_id, _ in entries])
+    await update.message.reply_text(format_leaderboard(title, entries, names))
+
+async def myscore_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the user's score and rank"""
+    user_id = update.effective_user.id
+    correct, answered, rank, players = await scoreboard.score(GLOBAL_BOARD, user_id)
+    if not answered:
+        await update.message.reply_text("📊 You haven't answered any quiz questions yet.")
+        return
+    lines = [
+        "📊 *Your score*\n",
+        f"• Correct: `{correct}` of `{answered}` ({correct / answered:.0%})",
+        f"• Global rank: `#{rank}` of `{players}`"
+    ]
+    chat = update.effective_chat
+    if chat.type != 'private':
+        chat_correct, _, chat_rank, chat_players = await scoreboard.score(chat.id, user_id)
+        if chat_rank:
+            lines.append(f"• In this chat: `{chat_correct}` correct, rank `#{chat_rank}` of `{chat_players}`")
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Cancel the quizzes being sent to this chat"""
+    user_id = update.effective_user.id
+    # In groups, members can only stop their own uploads; the owner can stop any
+    owner_or_private = user_id == OWNER_ID or update.effective_chat.type == 'private'
+    stopped = await cancel_deliveries(update.effective_chat.id, None if owner_or_private else user_id)
+    if stopped:
+        await update.message.reply_text(f"🛑 Stopping {stopped} quiz delivery(ies)")
+    else:
+        await update.message.reply_text("ℹ️ No quiz is being sent here")
+
+def get_queue_stats() -> dict:
+    """Summarise the job queue (blocking, call through run_db)"""
+    counts = {}
+    for row in jobs.aggregate([
+        {'$match': {'status': {'$in': ['pending', 'running']}}},
+        {'$group': {'_id': {'kind': '$kind', 'status': '$status'}, 'count': {'$sum': 1}}}
+    ]):
+        counts[row['_id']['kind'], row['_id']['status']] = row['count']
+    running = list(jobs.find(
+        {'kind': 'quiz_delivery', 'status': 'running'},
+        {'user_id': 1, 'chat_id': 1, 'owner': 1, 'question_count': 1, 'progress': 1}
+    ).limit(20))
+    return {'counts': counts, 'running': running}
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show job queue depth and delivery throughput (owner only)"""
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text("❌ Owner only command!")
+        return
+    
+    queue = await run_db(get_queue_stats)
+    lines = ["📬 *Job queue*\n"]
+    for (kind, status), count in sorted(queue['counts'].items()):
+        lines.append(f"• {kind}: `{count}` {status}")
+    if not queue['counts']:
+        lines.append("• Empty")
+    lines.append(
+        f"\nSend slots: `{delivery_slots.size - delivery_slots.free}`/`{delivery_slots.size}` busy, "
+        f"`{delivery_slots.waiting()}` waiting on this worker"
+    )
+    
+    if queue['running']:
+        lines.append("\n*Running deliveries:*")
+        now = datetime.utcnow()
+        for job in queue['running']:
+            progress = job.get('progress') or {}
+            sent = progress.get('sent', 0)
+            elapsed = (now - progress['started_at']).total_seconds() if progress else 0
+            rate = f"{sent / elapsed:.1f}/s" if elapsed > 0 else "starting"
+            lines.append(
+                f"• user `{job['user_id']}` → chat `{job['chat_id']}`: "
+                f"`{sent}`/`{job.get('question_count', '?')}` ({rate}) on `{job.get('owner')}`"
+            )
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+async def myplan_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    sub = await user_context(update, context).subscription()
+    
+    if sub:
         expires_at = sub['expires_at']
         
         # Format dates in IST
@@ -678,6 +2967,849 @@ async def plans_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error(f"Error in plans_command: {e}")
         await update.message.reply_text("⚠️ An error occurred. Please try again later.")
 
+# Background tasks
+background_tasks = set()
+
+def start_background_task(coro) -> asyncio.Task:
+    """Run a coroutine independently of the update that started it"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def cancel_background_tasks() -> None:
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+# Job queue
+# Long-running work (quiz delivery, broadcasts) is stored in the `jobs`
+# collection so any worker can run it. A worker claims a job with an atomic
+# find_one_and_update and keeps the claim alive with heartbeats; a job whose
+# owner stops heartbeating is reclaimed by another worker.
+job_handlers = {}
+job_wakeup = {'event': None}
+
+def job_handler(kind: str):
+    """Register a coroutine `handler(bot, job)` for a job kind"""
+    def register(func):
+        job_handlers[kind] = func
+        return func
+    return register
+
+async def enqueue_job(kind: str, **fields) -> ObjectId:
+    job = {
+        '_id': ObjectId(),
+        'kind': kind,
+        'status': 'pending',
+        'owner': None,
+        'attempts': 0,
+        'created_at': datetime.utcnow(),
+        **fields
+    }
+    await run_db(jobs.insert_one, job)
+    if job_wakeup['event']:
+        job_wakeup['event'].set()
+    return job['_id']
+
+def _claim_job(worker_id: str, kinds: dict = None):
+    """Claim the oldest runnable job, optionally limited by a `kind` filter"""
+    now = datetime.utcnow()
+    query = {'$or': [
+        {'status': 'pending'},
+        {'status': 'running', 'heartbeat_at': {'$lt': now - timedelta(seconds=JOB_STALE_AFTER)}}
+    ]}
+    if kinds:
+        query['kind'] = kinds
+    return jobs.find_one_and_update(
+        query,
+        {
+            '$set': {'status': 'running', 'owner': worker_id, 'heartbeat_at': now},
+            '$inc': {'attempts': 1}
+        },
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def _finish_job(job_id: ObjectId, worker_id: str, status: str, error: str = None) -> None:
+    update = {'$set': {'status': status, 'owner': None}}
+    if status in ('done', 'failed'):
+        update['$set']['finished_at'] = datetime.utcnow()
+        # A delivery's questions are the bulk of the document and aren't needed any more
+        update['$unset'] = {'questions': ''}
+    if error:
+        update['$set']['error'] = error
+    elif status == 'pending':
+        # Handed back at shutdown; that run doesn't count against JOB_MAX_ATTEMPTS
+        update['$inc'] = {'attempts': -1}
+    job = jobs.find_one_and_update(
+        {'_id': job_id, 'owner': worker_id}, update, projection={'kind': 1, 'broadcast_id': 1}
+    )
+    if job and status == 'failed' and job['kind'] == 'broadcast':
+        # Given up on: don't leave the broadcast looking like it is still running
+        broadcasts.update_one(
+            {'_id': job['broadcast_id'], 'status': 'running'},
+            {'$set': {'status': 'failed', 'error': error, 'finished_at': datetime.utcnow()}}
+        )
+
+class JobReleased(Exception):
+    """Raised by a job handler that stopped early and saved its state, to requeue the job"""
+
+class JobWorker:
+    """Claim and run jobs from the shared queue.
+    
+    Quiz deliveries have their own lane of `delivery_concurrency` jobs, since
+    they mostly wait on the fair send slots; everything else shares
+    `concurrency` slots, so a backlog of deliveries can't hold up a
+    broadcast or an expiry notice.
+    """
+    
+    def __init__(self, bot, worker_id: str = WORKER_ID, concurrency: int = JOB_CONCURRENCY,
+                 delivery_concurrency: int = DELIVERY_MAX_ACTIVE):
+        self.bot = bot
+        self.worker_id = worker_id
+        self.limits = {'quiz_delivery': delivery_concurrency, 'other': concurrency}
+        self.running = {}
+    
+    def _claimable(self):
+        """Return the `kind` filter for lanes with room, or None when all are full"""
+        busy = {'quiz_delivery': 0, 'other': 0}
+        for task in self.running.values():
+            busy[task.lane] += 1
+        deliveries = busy['quiz_delivery'] < self.limits['quiz_delivery']
+        others = busy['other'] < self.limits['other']
+        if deliveries and others:
+            return {}
+        if deliveries:
+            return {'$eq': 'quiz_delivery'}
+        if others:
+            return {'$ne': 'quiz_delivery'}
+        return None
+    
+    async def run(self) -> None:
+        wakeup = job_wakeup['event'] = asyncio.Event()
+        
+        def job_done(task):
+            self.running.pop(task.job_id, None)
+            wakeup.set()
+        
+        try:
+            while True:
+                wakeup.clear()
+                while (kinds := self._claimable()) is not None:
+                    try:
+                        job = await run_db(_claim_job, self.worker_id, kinds)
+                    except Exception as e:
+                        logger.warning(f"Couldn't claim jobs: {e}")
+                        job = None
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run_job(job))
+                    task.job_id = job['_id']
+                    task.lane = 'quiz_delivery' if job['kind'] == 'quiz_delivery' else 'other'
+                    self.running[job['_id']] = task
+                    task.add_done_callback(job_done)
+                
+                try:
+                    await asyncio.wait_for(wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Let deliveries finish their current poll and checkpoint; cancel what's left
+            stop_deliveries()
+            tasks = list(self.running.values())
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=JOB_DRAIN_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _heartbeat(self, job_id: ObjectId, work: asyncio.Task, lost: dict) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                result = await run_db(
+                    jobs.update_one,
+                    {'_id': job_id, 'owner': self.worker_id},
+                    {'$set': {'heartbeat_at': datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+                continue
+            if result.matched_count == 0:
+                logger.warning(f"Lost the claim on job {job_id}, stopping it")
+                lost['claim'] = True
+                work.cancel()
+                return
+    
+    async def _run_job(self, job: dict) -> None:
+        job_id = job['_id']
+        handler = job_handlers.get(job['kind'])
+        if handler is None:
+            await run_db(_finish_job, job_id, self.worker_id, 'failed', f"Unknown job kind {job['kind']}")
+            return
+        
+        lost = {'claim': False}
+        work = asyncio.create_task(handler(self.bot, job))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, work, lost))
+        try:
+            await work
+            status, error = 'done', None
+        except JobReleased as e:
+            logger.info(f"Job {job_id} ({job['kind']}) handed back: {e}")
+            status, error = 'pending', None
+        except asyncio.CancelledError:
+            if lost['claim']:
+                return
+            # Shutting down: hand the job back so another worker resumes it
+            await run_db(_finish_job, job_id, self.worker_id, 'pending')
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} ({job['kind']}) failed: {e}")
+            status = 'failed' if job['attempts'] >= JOB_MAX_ATTEMPTS else 'pending'
+            error = str(e)
+        finally:
+            heartbeat.cancel()
+        await run_db(_finish_job, job_id, self.worker_id, status, error)
+
+# Cluster coordination
+def _acquire_lease(name: str, holder: str, ttl: int) -> bool:
+    """Take or renew a named lease; only one holder can own it until it expires"""
+    now = datetime.utcnow()
+    try:
+        leases.find_one_and_update(
+            {'_id': name, '$or': [{'holder': holder}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'holder': holder, 'expires_at': now + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # Someone else holds an unexpired lease, so the upsert collided on _id
+        return False
+
+def _release_lease(name: str, holder: str) -> None:
+    leases.delete_one({'_id': name, 'holder': holder})
+
+# Premium expiry
+# Active subscriptions are held in memory with their expiry times on a
+# min-heap, so premium checks don't query Mongo and users are told before
+# and when their plan lapses. Notices go through the job queue with ids
+# derived from (user, expiry), so in CLUSTER_MODE every replica can
+# schedule them but each is sent once.
+def utc_timestamp(dt: datetime) -> float:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+class PremiumExpiryScheduler:
+    def __init__(self, warn_before: int = EXPIRY_WARNING, resync_interval: int = EXPIRY_RESYNC_INTERVAL):
+        self.warn_before = warn_before
+        self.resync_interval = resync_interval
+        self.loaded = False
+        self._expiries = {}  # user_id -> expires_at
+        self._heap = []  # (due, user_id, kind, expires_at timestamp)
+        self._wakeup = None  # made in run(), on the loop that will wait on it
+    
+    def active(self, user_id: int):
+        """Return the active subscription for a user from memory"""
+        expires_at = self._expiries.get(user_id)
+        if expires_at is None or utc_timestamp(expires_at) <= time.time():
+            return None
+        return {'user_id': user_id, 'expires_at': expires_at}
+    
+    def schedule(self, user_id: int, expires_at: datetime, catch_up: bool = False) -> None:
+        """Track a subscription; `catch_up` also sends a warning that fell due while we were down"""
+        self._expiries[user_id] = expires_at
+        expires = utc_timestamp(expires_at)
+        warn_at = expires - self.warn_before
+        if warn_at > time.time() or (catch_up and expires > time.time()):
+            heapq.heappush(self._heap, (warn_at, user_id, 'premium_expiring', expires))
+        heapq.heappush(self._heap, (expires, user_id, 'premium_expired', expires))
+        if self._wakeup:
+            self._wakeup.set()
+    
+    def cancel(self, user_id: int) -> None:
+        # Heap entries are dropped lazily when they no longer match _expiries
+        self._expiries.pop(user_id, None)
+    
+    async def load(self) -> None:
+        """(Re)load subscriptions, including ones that lapsed while we were down"""
+        since = datetime.utcnow() - timedelta(seconds=self.warn_before)
+        subs = await run_db(
+            lambda: list(premium_subscriptions.find({'expires_at': {'$gt': since}}, {'user_id': 1, 'expires_at': 1}))
+        )
+        current = {sub['user_id']: sub['expires_at'] for sub in subs}
+        for user_id in set(self._expiries) - set(current):
+            self.cancel(user_id)
+            premium_cache.invalidate(user_id)
+        for user_id, expires_at in current.items():
+            if self._expiries.get(user_id) != expires_at:
+                self.schedule(user_id, expires_at, catch_up=not self.loaded)
+                premium_cache.invalidate(user_id)
+        self.loaded = True
+    
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, user_id, kind, expires = heapq.heappop(self._heap)
+            expires_at = self._expiries.get(user_id)
+            if expires_at is None or utc_timestamp(expires_at) != expires:
+                continue  # cancelled or renewed since it was scheduled
+            if kind == 'premium_expired':
+                del self._expiries[user_id]
+                premium_cache.invalidate(user_id)
+            due.append({
+                '_id': f"{kind}:{user_id}:{int(expires)}",
+                'kind': kind,
+                'user_id': user_id,
+                'expires_at': expires_at
+            })
+        return due
+    
+    async def run(self) -> None:
+        self._wakeup = asyncio.Event()
+        next_resync = time.monotonic() if not self.loaded else time.monotonic() + self.resync_interval
+        while True:
+            if time.monotonic() >= next_resync:
+                try:
+                    await self.load()
+                except Exception as e:
+                    logger.warning(f"Couldn't reload premium subscriptions: {e}")
+                next_resync = time.monotonic() + self.resync_interval
+            
+            due = self._pop_due(time.time())
+            if due:
+                await enqueue_unique_jobs(due)
+            
+            timeout = next_resync - time.monotonic()
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+premium_expiry = PremiumExpiryScheduler()
+
+async def enqueue_unique_jobs(items: list) -> int:
+    """Enqueue jobs with caller-chosen ids in one insert; existing ids are skipped"""
+    now = datetime.utcnow()
+    docs = [{'status': 'pending', 'owner': None, 'attempts': 0, 'created_at': now, **item} for item in items]
+    try:
+        result = await run_db(jobs.insert_many, docs, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        inserted = e.details.get('nInserted', 0)
+    if inserted and job_wakeup['event']:
+        job_wakeup['event'].set()
+    return inserted
+
+async def _premium_notice_still_valid(job: dict) -> bool:
+    sub = await run_db(premium_subscriptions.find_one, {'user_id': job['user_id']})
+    if job['kind'] == 'premium_expired':
+        # Renewed after expiry but before the notice went out
+        return sub is None or sub['expires_at'] <= datetime.utcnow()
+    return sub is not None and sub['expires_at'] == job['expires_at']
+
+@job_handler('premium_expiring')
+async def send_expiring_notice(bot, job: dict) -> None:
+    if not await _premium_notice_still_valid(job):
+        return
+    expire_date, expire_time = format_ist(job['expires_at'])
+    try:
+        await bot.send_message(
+            chat_id=job['user_id'],
+            text=(
+                "⏰ Your premium plan expires in 24 hours\n"
+                f"({expire_date} {expire_time} IST).\n\n"
+                "Renew with /upgrade to keep unlimited access."
+            )
+        )
+    except (Forbidden, BadRequest) as e:
+        logger.info(f"Couldn't send expiry warning to {job['user_id']}: {e}")
+
+@job_handler('premium_expired')
+async def send_expired_notice(bot, job: dict) -> None:
+    if not await _premium_notice_still_valid(job):
+        return
+    await record_event(premium_expired=1)
+    try:
+        await bot.send_message(
+            chat_id=job['user_id'],
+            text=(
+                "⌛ Your premium plan has expired.\n\n"
+                f"Free limits apply again: {FREE_USER_LIMIT} questions per {COOLDOWN_MINUTES} minutes.\n"
+                "Renew anytime with /upgrade"
+            )
+        )
+    except (Forbidden, BadRequest) as e:
+        logger.info(f"Couldn't send expiry notice to {job['user_id']}: {e}")
+
+# Scores and leaderboards
+# Quiz answers are scored in memory: each leaderboard buckets its players by
+# score and keeps a Fenwick tree over the bucket sizes, so an answer and a
+# rank lookup are O(log max_score), and the top of the board descends the
+# tree one bucket at a time from the highest score. Score deltas are merged per (chat, user) and flushed with
+# one bulk_write every SCORE_FLUSH_INTERVAL seconds. Chat 0 holds the global
+# board, which is always in memory; chat boards are loaded when used.
+GLOBAL_BOARD = 0
+
+class RankedScores:
+    """One leaderboard's scores, with O(log max_score) updates and rank lookups"""
+    
+    def __init__(self):
+        self.scores = {}  # user_id -> correct answers
+        self.answered = {}  # user_id -> answers
+        self._members = {}  # score -> {user_id: None}
+        self._tree = [0] * 64  # Fenwick tree; position score + 1 counts the users with that score
+    
+    def __len__(self) -> int:
+        return len(self.scores)
+    
+    def _reserve(self, score: int) -> None:
+        """Grow the tree to cover `score`, rebuilding it from the buckets"""
+        size = len(self._tree)
+        if score + 1 < size:
+            return
+        while score + 1 >= size:
+            size *= 2
+        tree = [0] * size
+        for value, members in self._members.items():
+            tree[value + 1] = len(members)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                tree[parent] += tree[i]
+        self._tree = tree
+    
+    def _count(self, score: int, delta: int) -> None:
+        i = score + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+    
+    def _at_most(self, score: int) -> int:
+        """Number of users scoring `score` or less"""
+        i, count = score + 1, 0
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count
+    
+    def set(self, user_id: int, score: int) -> None:
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        self._reserve(score)
+        if old is not None:
+            members = self._members[old]
+            del members[user_id]
+            if not members:
+                del self._members[old]
+            self._count(old, -1)
+        self.scores[user_id] = score
+        self._members.setdefault(score, {})[user_id] = None
+        self._count(score, 1)
+    
+    def add(self, user_id: int, points: int) -> None:
+        self.set(user_id, self.scores.get(user_id, 0) + points)
+    
+    def rank(self, user_id: int):
+        """1-based rank, shared by users with the same score"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return len(self.scores) - self._at_most(score) + 1
+    
+    def _lowest_with(self, count: int) -> int:
+        """Lowest score with at least `count` users scoring it or less (1 <= count <= len)"""
+        position, step = 0, len(self._tree) // 2
+        while step:
+            if position + step < len(self._tree) and self._tree[position + step] < count:
+                position += step
+                count -= self._tree[position]
+            step //= 2
+        return position  # tree position + 1 holds the score
+    
+    def top(self, count: int) -> list:
+        """The `count` best players; ties are listed in the order they reached the score"""
+        entries = []
+        below = len(self.scores)  # players in the buckets not visited yet
+        while below and len(entries) < count:
+            score = self._lowest_with(below)
+            members = self._members[score]
+            entries.extend((user_id, score) for user_id in itertools.islice(members, count - len(entries)))
+            below -= len(members)
+        return entries
+
+class PollRegistry:
+    """Remember which chat and correct option each sent quiz poll belongs to.
+    
+    Polls are kept in memory and written to the `polls` collection in the
+    score flush, so a replica that didn't send a poll can still score its
+    answers (see Scoreboard.answer).
+    """
+    
+    def __init__(self, keep_for: int = POLL_KEEP_SECONDS):
+        self.keep_for = keep_for
+        self._polls = OrderedDict()  # poll_id -> (chat_id, correct_id, expires)
+        self._pending = []
+    
+    def add(self, poll_id: str, chat_id: int, correct_id: int) -> None:
+        expires = time.time() + self.keep_for
+        self._polls[poll_id] = (chat_id, correct_id, expires)
+        self._pending.append({
+            '_id': poll_id, 'chat_id': chat_id, 'correct_id': correct_id,
+            'expires_at': datetime.utcnow() + timedelta(seconds=self.keep_for)
+        })
+        while self._polls and next(iter(self._polls.values()))[2] < time.time():
+            self._polls.popitem(last=False)
+    
+    def get(self, poll_id: str):
+        poll = self._polls.get(poll_id)
+        return (poll[0], poll[1]) if poll else None
+    
+    async def lookup(self, poll_ids: list) -> dict:
+        """Find polls sent by other replicas: {poll_id: (chat_id, correct_id)}"""
+        docs = await run_db(lambda: list(polls.find({'_id': {'$in': poll_ids}})))
+        return {doc['_id']: (doc['chat_id'], doc['correct_id']) for doc in docs}
+    
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            await run_db(polls.insert_many, pending, ordered=False)
+        except Exception as e:
+            logger.warning(f"Couldn't store {len(pending)} polls: {e}")
+
+class Scoreboard:
+    """The global board plus the boards of recently used chats.
+    
+    A chat's board is loaded from Mongo when /leaderboard or /myscore first
+    needs it and dropped after SCORE_BOARD_IDLE seconds without use; answers
+    in a chat whose board isn't loaded only go to the pending deltas. Loaded
+    boards pick up other replicas' answers from the rows whose updated_at
+    moved since the last reload.
+    """
+    
+    def __init__(self, idle_after: float = SCORE_BOARD_IDLE, max_names: int = SCORE_MAX_NAMES):
+        self.idle_after = idle_after
+        self.max_names = max_names
+        self.boards = {GLOBAL_BOARD: RankedScores()}  # chat_id -> RankedScores
+        self.names = OrderedDict()  # user_id -> display name, least recently seen first
+        self._used = {}  # chat_id -> time.monotonic() of the chat board's last use
+        self._pending = {}  # (chat_id, user_id) -> {'correct': n, 'answered': n}
+        self._unresolved = []  # answers to polls this replica didn't send
+        self._reloaded_at = None  # updated_at watermark for the next reload
+        # Loads read the pending deltas a flush would otherwise move into Mongo mid-query.
+        # Made on first use: before Python 3.10 a Lock binds to the loop current at creation
+        self._lock = None
+    
+    def _locked(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+    
+    def answer(self, poll_id: str, user_id: int, name: str, option_id: int) -> None:
+        poll = poll_registry.get(poll_id)
+        if poll is None:
+            # Sent by another replica whose poll batch may not be stored yet
+            self._unresolved.append((poll_id, user_id, name, option_id, time.monotonic() + 60))
+            return
+        chat_id, correct_id = poll
+        self.record(chat_id, user_id, name, option_id == correct_id)
+    
+    async def _resolve(self) -> None:
+        unresolved, self._unresolved = self._unresolved, []
+        if not unresolved:
+            return
+        try:
+            found = await poll_registry.lookup(list({item[0] for item in unresolved}))
+        except Exception as e:
+            logger.warning(f"Couldn't look up polls: {e}")
+            found = {}
+        now = time.monotonic()
+        for poll_id, user_id, name, option_id, deadline in unresolved:
+            if poll_id in found:
+                chat_id, correct_id = found[poll_id]
+                self.record(chat_id, user_id, name, option_id == correct_id)
+            elif deadline > now:
+                self._unresolved.append((poll_id, user_id, name, option_id, deadline))
+    
+    def _remember_name(self, user_id: int, name: str) -> None:
+        self.names[user_id] = name
+        self.names.move_to_end(user_id)
+        if len(self.names) > self.max_names:
+            self.names.popitem(last=False)
+    
+    def record(self, chat_id: int, user_id: int, name: str, correct: bool) -> None:
+        self._remember_name(user_id, name)
+        for board_id in {chat_id, GLOBAL_BOARD}:
+            board = self.boards.get(board_id)
+            if board is not None:
+                board.add(user_id, int(correct))
+                board.answered[user_id] = board.answered.get(user_id, 0) + 1
+            delta = self._pending.setdefault((board_id, user_id), {'correct': 0, 'answered': 0})
+            delta['correct'] += int(correct)
+            delta['answered'] += 1
+    
+    async def board(self, chat_id: int) -> RankedScores:
+        """A chat's board, loaded from Mongo if it isn't in memory"""
+        if chat_id != GLOBAL_BOARD:
+            self._used[chat_id] = time.monotonic()
+        board = self.boards.get(chat_id)
+        if board is None:
+            async with self._locked():
+                board = self.boards.get(chat_id) or await self._load_board(chat_id)
+        return board
+    
+    async def score(self, chat_id: int, user_id: int) -> tuple:
+        """Return (correct, answered, rank, players) on a board"""
+        board = await self.board(chat_id)
+        if user_id not in board.scores:
+            return 0, 0, None, len(board)
+        return board.scores[user_id], board.answered[user_id], board.rank(user_id), len(board)
+    
+    async def top(self, chat_id: int, count: int = LEADERBOARD_SIZE) -> list:
+        return (await self.board(chat_id)).top(count)
+    
+    async def display_names(self, user_ids: list) -> dict:
+        """Names for a leaderboard, from memory or else from the stored scores"""
+        names = {user_id: self.names[user_id] for user_id in user_ids if user_id in self.names}
+        missing = [user_id for user_id in user_ids if user_id not in names]
+        if missing:
+            docs = await run_db(lambda: list(scores.find(
+                {'chat_id': GLOBAL_BOARD, 'user_id': {'$in': missing}}, {'user_id': 1, 'name': 1}
+            )))
+            for doc in docs:
+                if doc.get('name'):
+                    names[doc['user_id']] = doc['name']
+                    self._remember_name(doc['user_id'], doc['name'])
+        return names
+    
+    def _query(self, query: dict) -> list:
+        return list(scores.find(query, {'_id': 0, 'chat_id': 1, 'user_id': 1, 'correct': 1, 'answered': 1}))
+    
+    async def _load_board(self, chat_id: int) -> RankedScores:
+        """Replace a board with its stored totals plus unflushed answers; call with the lock held"""
+        docs = await run_db(self._query, {'chat_id': chat_id})
+        totals = {doc['user_id']: [doc['correct'], doc['answered']] for doc in docs}
+        for (board_id, user_id), delta in self._pending.items():
+            if board_id == chat_id:
+                total = totals.setdefault(user_id, [0, 0])
+                total[0] += delta['correct']
+                total[1] += delta['answered']
+        board = RankedScores()
+        for user_id, (correct, answered) in totals.items():
+            board.set(user_id, correct)
+            board.answered[user_id] = answered
+        self.boards[chat_id] = board
+        return board
+    
+    async def reload(self) -> None:
+        """Load the global board the first time, then apply the rows changed since the last reload"""
+        async with self._locked():
+            started = datetime.utcnow()
+            if self._reloaded_at is None:
+                await self._load_board(GLOBAL_BOARD)
+            else:
+                docs = await run_db(self._query, {
+                    'updated_at': {'$gt': self._reloaded_at},
+                    'chat_id': {'$in': list(self.boards)}
+                })
+                for doc in docs:
+                    board = self.boards.get(doc['chat_id'])
+                    if board is None:
+                        continue
+                    delta = self._pending.get((doc['chat_id'], doc['user_id']), {'correct': 0, 'answered': 0})
+                    board.set(doc['user_id'], doc['correct'] + delta['correct'])
+                    board.answered[doc['user_id']] = doc['answered'] + delta['answered']
+            # Rows stamped by other replicas just before `started` may not be visible yet
+            self._reloaded_at = started - timedelta(seconds=SCORE_RELOAD_LAG)
+    
+    def evict_idle(self) -> None:
+        """Drop chat boards that haven't been used for idle_after seconds"""
+        cutoff = time.monotonic() - self.idle_after
+        for chat_id, used in list(self._used.items()):
+            if used < cutoff:
+                del self._used[chat_id]
+                self.boards.pop(chat_id, None)
+    
+    async def flush(self) -> None:
+        async with self._locked():
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            now = datetime.utcnow()
+            operations = []
+            for (chat_id, user_id), delta in pending.items():
+                fields = {'updated_at': now}
+                if user_id in self.names:
+                    fields['name'] = self.names[user_id]
+                operations.append(UpdateOne(
+                    {'chat_id': chat_id, 'user_id': user_id}, {'$inc': delta, '$set': fields}, upsert=True
+                ))
+            try:
+                await run_db(scores.bulk_write, operations, ordered=False)
+            except Exception as e:
+                logger.warning(f"Score flush failed, retrying later: {e}")
+                for key, delta in pending.items():
+                    merged = self._pending.setdefault(key, {'correct': 0, 'answered': 0})
+                    merged['correct'] += delta['correct']
+                    merged['answered'] += delta['answered']
+    
+    async def run(self, interval: float = SCORE_FLUSH_INTERVAL) -> None:
+        """Flush answers periodically; reload totals now and then for answers seen by other replicas"""
+        next_reload = time.monotonic()
+        try:
+            while True:
+                if time.monotonic() >= next_reload:
+                    try:
+                        await self.reload()
+                    except Exception as e:
+                        logger.warning(f"Couldn't load scores: {e}")
+                    self.evict_idle()
+                    next_reload = time.monotonic() + SCORE_RELOAD_INTERVAL
+                await asyncio.sleep(interval)
+                await poll_registry.flush()
+                await self._resolve()
+                await self.flush()
+        finally:
+            await poll_registry.flush()
+            await self.flush()
+
+poll_registry = PollRegistry()
+scoreboard = Scoreboard()
+
+# Broadcast engine
+def _next_broadcast_recipients(after_user_id: int, limit: int) -> list:
+    cursor = users.find(
+        {'user_id': {'$gt': after_user_id}, 'blocked': {'$ne': True}},
+        {'_id': 0, 'user_id': 1}
+    ).sort('user_id', 1).limit(limit)
+    return [user['user_id'] for user in cursor]
+
+async def create_broadcast(message: str, total: int, chat_id: int, message_id: int) -> dict:
+    job = {
+        '_id': ObjectId(),
+        'message': message,
+        'status': 'running',
+        'created_at': datetime.utcnow(),
+        'total': total,
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'last_user_id': 0,
+        'progress_chat_id': chat_id,
+        'progress_message_id': message_id
+    }
+    await run_db(broadcasts.insert_one, job)
+    return job
+
+async def _send_broadcast_message(bot, user_id: int, text: str) -> str:
+    try:
+        await bot.send_message(chat_id=user_id, text=text)
+        return 'sent'
+    except Forbidden:
+        return 'blocked'
+    except BadRequest as e:
+        if 'chat not found' in str(e).lower():
+            return 'blocked'
+        logger.error(f"Broadcast to {user_id} failed: {e}", extra={'log_key': 'broadcast_failed'})
+        return 'failed'
+    except Exception as e:
+        logger.error(f"Broadcast to {user_id} failed: {e}", extra={'log_key': 'broadcast_failed'})
+        return 'failed'
+
+async def run_broadcast(bot, job: dict) -> None:
+    """Deliver a broadcast in batches, checkpointing progress after each batch.
+    
+    Recipients are walked in user_id order, so `last_user_id` is enough to
+    resume an interrupted job. Users who blocked the bot are flagged and
+    skipped by later broadcasts.
+    """
+    job_id = job['_id']
+    text = f"📣 Broadcast Message\n\n{job['message']}"
+    counts = {key: job.get(key, 0) for key in ('sent', 'failed', 'blocked')}
+    last_user_id = job.get('last_user_id', 0)
+    total = job['total']
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    last_progress = 0.0
+    
+    async def deliver(user_id: int) -> str:
+        async with semaphore:
+            return await _send_broadcast_message(bot, user_id, text)
+    
+    async def show_progress(text: str) -> None:
+        try:
+            await bot.edit_message_text(
+                chat_id=job['progress_chat_id'],
+                message_id=job['progress_message_id'],
+                text=text
+            )
+        except Exception:
+            pass
+    
+    while True:
+        recipients = await run_db(_next_broadcast_recipients, last_user_id, BROADCAST_BATCH_SIZE)
+        if not recipients:
+            break
+        
+        results = await asyncio.gather(*(deliver(user_id) for user_id in recipients))
+        batch = {key: results.count(key) for key in counts}
+        blocked_ids = [uid for uid, result in zip(recipients, results) if result == 'blocked']
+        if blocked_ids:
+            await run_db(
+                users.update_many, {'user_id': {'$in': blocked_ids}},
+                {'$set': {'blocked': True, 'updated_at': datetime.utcnow()}}
+            )
+            user_writes.forget(blocked_ids)
+        
+        last_user_id = recipients[-1]
+        await run_db(
+            broadcasts.update_one,
+            {'_id': job_id},
+            {'$set': {'last_user_id': last_user_id}, '$inc': batch}
+        )
+        for key in counts:
+            counts[key] += batch[key]
+        
+        if time.monotonic() - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            done = sum(counts.values())
+            percent = int(done / total * 100) if total else 100
+            await show_progress(
+                f"📤 Broadcasting to {total} users...\n"
+                f"{percent}% complete ({done}/{total})\n"
+                f"✅ Success: {counts['sent']} ❌ Failed: {counts['failed']} 🚫 Blocked: {counts['blocked']}"
+            )
+    
+    await run_db(
+        broadcasts.update_one,
+        {'_id': job_id},
+        {'$set': {'status': 'done', 'finished_at': datetime.utcnow()}}
+    )
+    await show_progress(
+        f"✅ Broadcast complete!\n"
+        f"• Total recipients: {total}\n"
+        f"• Successfully sent: {counts['sent']}\n"
+        f"• Failed: {counts['failed']}\n"
+        f"• Blocked the bot: {counts['blocked']}"
+    )
+
+@job_handler('broadcast')
+async def run_broadcast_job(bot, job: dict) -> None:
+    broadcast = await run_db(broadcasts.find_one, {'_id': job['broadcast_id']})
+    if broadcast and broadcast['status'] == 'running':
+        await run_broadcast(bot, broadcast)
+
+@job_handler('quiz_delivery')
+async def run_quiz_delivery(bot, job: dict) -> None:
+    sent = await deliver_quiz(bot, job)
+    await record_quiz(job['user_id'], sent)
+
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send message to all users (owner only)"""
     try:
@@ -692,7 +3824,7 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
         
         message = " ".join(context.args)
-        total_users = users.count_documents({})
+        total_users = await count_broadcast_recipients()
         
         keyboard = [
             [
@@ -730,84 +3862,397 @@ async def broadcast_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             await query.edit_message_text("❌ Broadcast message missing")
             return
         
-        all_users = users.find({})
-        total = all_users.count()
-        success = 0
-        failed = 0
-        
+        total = await count_broadcast_recipients()
         progress_msg = await query.edit_message_text(
             f"📤 Broadcasting to {total} users...\n0% complete"
         )
+        context.user_data.pop('broadcast_message', None)
         
-        for idx, user in enumerate(all_users, 1):
+        broadcast = await create_broadcast(message, total, progress_msg.chat_id, progress_msg.message_id)
+        await enqueue_job('broadcast', broadcast_id=broadcast['_id'])
+    except Exception as e:
+        logger.error(f"Error in broadcast_button: {e}")
+        await query.edit_message_text("⚠️ An error occurred during broadcast.")
+
+# Backup and restore
+# Each run writes a directory under BACKUP_DIR with gzipped JSONL chunks of
+# the documents changed since the previous run's watermark and a manifest.
+# Every write to an incrementally backed-up collection stamps `updated_at`;
+# small collections are copied whole on every run instead.
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_CHUNK_SIZE = 50000  # documents per file
+BACKUP_LAG = 60  # seconds; writes stamped just before a run may not be visible to it yet
+RESTORE_BATCH = 1000
+BACKUP_COLLECTIONS = {
+    # name -> 'incremental' (changed documents only), 'tracked' (incremental,
+    # plus the live keys so deletes are replayed) or 'snapshot' (whole copy).
+    # Subscriptions are removed by /rem and the expires_at TTL index, library
+    # quizzes by /delquiz; users and scores never are.
+    'users': 'incremental',
+    'premium_subscriptions': 'tracked',
+    'quiz_library': 'tracked',
+    'scores': 'incremental',
+    'plans': 'snapshot',
+    'stats': 'snapshot',
+}
+
+def backup_runs(directory: str = BACKUP_DIR) -> list:
+    """Return the manifests of completed backups, oldest first"""
+    runs = []
+    if not os.path.isdir(directory):
+        return runs
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name, 'manifest.json')
+        # A .partial directory is a run that was interrupted before its rename
+        if not name.endswith('.partial') and os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            manifest['path'] = os.path.join(directory, name)
+            runs.append(manifest)
+    return runs
+
+def _write_chunks(documents, directory: str, prefix: str) -> tuple:
+    """Write documents as gzipped extended-JSON lines, BACKUP_CHUNK_SIZE per file"""
+    files, count, out = [], 0, None
+    try:
+        for doc in documents:
+            if count % BACKUP_CHUNK_SIZE == 0:
+                if out:
+                    out.close()
+                files.append(f"{prefix}-{len(files) + 1:04d}.jsonl.gz")
+                out = gzip.open(os.path.join(directory, files[-1]), 'wt', encoding='utf-8', compresslevel=6)
+            out.write(json_util.dumps(doc) + '\n')
+            count += 1
+    finally:
+        if out:
+            out.close()
+    return files, count
+
+def _read_chunks(directory: str, files: list):
+    for name in files:
+        with gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json_util.loads(line)
+
+def run_backup(full: bool = False, directory: str = BACKUP_DIR) -> dict:
+    """Back up what changed since the last run, or everything if `full` or there is no earlier run"""
+    started = time.perf_counter()
+    previous = backup_runs(directory)
+    # A collection the last run didn't cover has no base to build on
+    if full or not previous or set(BACKUP_COLLECTIONS) - set(previous[-1]['collections']):
+        since = None
+    else:
+        since = datetime.fromisoformat(previous[-1]['until'])
+    until = datetime.utcnow() - timedelta(seconds=BACKUP_LAG)
+    name = until.strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(directory, name)
+    partial = path + '.partial'
+    os.makedirs(partial)
+    
+    manifest = {
+        'kind': 'incremental' if since else 'full',
+        'since': since.isoformat() if since else None,
+        'until': until.isoformat(),
+        'collections': {}
+    }
+    for collection_name, mode in BACKUP_COLLECTIONS.items():
+        collection = db[collection_name]
+        # No upper bound: anything newer than `until` is simply saved again next run
+        query = {'updated_at': {'$gt': since}} if since and mode != 'snapshot' else {}
+        files, count = _write_chunks(collection.find(query), partial, collection_name)
+        entry = {'files': files, 'documents': count}
+        if mode == 'tracked':
+            # Restore keeps only the documents that still existed at this run
+            entry['keys'], _ = _write_chunks(
+                collection.find({}, {'_id': 1}), partial, f"{collection_name}.keys"
+            )
+        manifest['collections'][collection_name] = entry
+    manifest['seconds'] = round(time.perf_counter() - started, 3)
+    
+    with open(os.path.join(partial, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(partial, path)
+    logger.info(
+        f"{manifest['kind'].capitalize()} backup {name}: "
+        + ', '.join(f"{n} {c['documents']}" for n, c in manifest['collections'].items())
+        + f" in {manifest['seconds']}s"
+    )
+    return manifest
+
+def restore_backup(until: datetime = None, directory: str = BACKUP_DIR, drop: bool = False) -> dict:
+    """Restore the backed-up collections as of the last backup taken at or before `until`.
+    
+    Replays the last full backup before that point and the incremental runs
+    after it, newest first, so each document is inserted once in its latest
+    version; snapshot collections come from the last run alone. Every
+    collection is checked before anything is written. Returns the number of
+    documents restored per collection.
+    """
+    if until is not None and until.tzinfo:
+        until = until.astimezone(timezone.utc).replace(tzinfo=None)
+    runs = [run for run in backup_runs(directory)
+            if until is None or datetime.fromisoformat(run['until']) <= until]
+    full_runs = [i for i, run in enumerate(runs) if run['kind'] == 'full']
+    if not full_runs:
+        raise ValueError("No full backup to restore from")
+    chain = runs[full_runs[-1]:]
+    latest = chain[-1]
+    names = [name for name in BACKUP_COLLECTIONS if name in latest['collections']]
+    if not drop:
+        occupied = [name for name in names if db[name].estimated_document_count()]
+        if occupied:
+            raise ValueError(f"{', '.join(occupied)} not empty; restore with drop=True to replace them")
+    
+    restored = {}
+    for collection_name in names:
+        collection = db[collection_name]
+        if drop:
+            collection.drop()
+        
+        mode = BACKUP_COLLECTIONS[collection_name]
+        live = None
+        if mode == 'tracked':
+            live = {doc['_id'] for doc in _read_chunks(latest['path'], latest['collections'][collection_name]['keys'])}
+        sources = [latest] if mode == 'snapshot' else reversed(chain)
+        seen = set()
+        batch = []
+        count = 0
+        for run in sources:
+            for doc in _read_chunks(run['path'], run['collections'][collection_name]['files']):
+                if doc['_id'] in seen or (live is not None and doc['_id'] not in live):
+                    continue
+                seen.add(doc['_id'])
+                batch.append(doc)
+                if len(batch) >= RESTORE_BATCH:
+                    collection.insert_many(batch, ordered=False)
+                    count += len(batch)
+                    batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+            count += len(batch)
+        restored[collection_name] = count
+    
+    ensure_indexes()
+    logger.info(f"Restored {restored} as of {latest['until']} ({len(chain)} backup(s))")
+    return restored
+
+def backup_cli(argv: list) -> None:
+    """`python bot.py backup [--full]` or `python bot.py restore [--until ISO-TIME] [--drop]`"""
+    parser = argparse.ArgumentParser(prog='bot.py', description="Back up or restore the bot's collections")
+    commands = parser.add_subparsers(dest='command', required=True)
+    backup_parser = commands.add_parser('backup')
+    backup_parser.add_argument('--full', action='store_true', help="ignore the watermark and copy everything")
+    backup_parser.add_argument('--dir', default=BACKUP_DIR)
+    restore_parser = commands.add_parser('restore')
+    restore_parser.add_argument('--until', type=datetime.fromisoformat, help="UTC time to restore to (default: latest)")
+    restore_parser.add_argument('--drop', action='store_true', help="replace the existing collections")
+    restore_parser.add_argument('--dir', default=BACKUP_DIR)
+    args = parser.parse_args(argv)
+    
+    setup_logging()
+    try:
+        if args.command == 'backup':
+            run_backup(args.full, args.dir)
+        else:
+            restore_backup(args.until, args.dir, args.drop)
+    finally:
+        log_writer.stop()
+
+async def prepare_database() -> None:
+    """Build indexes and seed statistics without holding up the first update"""
+    delay = 1
+    while True:
+        try:
+            await run_db(ensure_indexes)
+            await run_db(seed_stats)
+            startup.mark('indexes')
+            return
+        except Exception as e:
+            logger.warning(f"Database setup failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+async def post_init(application: Application) -> None:
+    start_background_task(monitor_loop_lag())
+    start_background_task(monitor_readiness(application))
+    start_background_task(prepare_database())
+    start_background_task(JobWorker(application.bot).run())
+    start_background_task(user_writes.run())
+    start_background_task(scoreboard.run())
+    # Loads the subscriptions first; premium checks use Mongo until then
+    start_background_task(premium_expiry.run())
+
+async def post_shutdown(application: Application) -> None:
+    # Claimed jobs are handed back to the queue and resume on another worker
+    await cancel_background_tasks()
+
+def webhook_secret(token: str) -> str:
+    """Secret token for setWebhook; derived from the bot token unless configured"""
+    return WEBHOOK_SECRET or hashlib.sha256(token.encode()).hexdigest()
+
+def build_application(token: str, base_url: str = None, base_file_url: str = None) -> Application:
+    builder = (
+        Application.builder()
+        .token(token)
+        .rate_limiter(outbound)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+    )
+    if base_url:
+        builder = builder.base_url(base_url).base_file_url(base_file_url or base_url)
+    application = builder.build()
+    
+    # Runs before the handlers in group 0 and shares their context
+    application.add_handler(TypeHandler(Update, load_user_context), group=-1)
+    
+    # Command handlers
+    application.add_handler(CommandHandler("start", instrumented(start)))
+    application.add_handler(CommandHandler("about", instrumented(about_command)))
+    application.add_handler(CommandHandler("help", instrumented(help_command)))
+    application.add_handler(CommandHandler("createquiz", instrumented(create_quiz)))
+    application.add_handler(CommandHandler("stats", instrumented(stats_command)))
+    application.add_handler(CommandHandler("add", instrumented(add_command)))
+    application.add_handler(CommandHandler("rem", instrumented(rem_command)))
+    application.add_handler(CommandHandler("upgrade", instrumented(upgrade_command)))
+    application.add_handler(CommandHandler("myplan", instrumented(myplan_command)))
+    application.add_handler(CommandHandler("plans", instrumented(plans_command)))
+    application.add_handler(CommandHandler("broadcast", instrumented(broadcast_command)))
+    application.add_handler(CommandHandler("myquizzes", instrumented(myquizzes_command)))
+    application.add_handler(CommandHandler("replay", instrumented(replay_command)))
+    application.add_handler(CommandHandler("delquiz", instrumented(delquiz_command)))
+    application.add_handler(CommandHandler("leaderboard", instrumented(leaderboard_command)))
+    application.add_handler(CommandHandler("myscore", instrumented(myscore_command)))
+    application.add_handler(CommandHandler("stop", instrumented(stop_command)))
+    application.add_handler(CommandHandler("queue", instrumented(queue_command)))
+    application.add_handler(PollAnswerHandler(instrumented(poll_answer_handler)))
+    # Other documents in groups are none of the bot's business; in private
+    # chats they get the list of supported formats
+    application.add_handler(MessageHandler(
+        quiz_document_filter() | (filters.Document.ALL & filters.ChatType.PRIVATE),
+        instrumented(handle_document)
+    ))
+    
+    # Callback handler
+    application.add_handler(CallbackQueryHandler(instrumented(broadcast_button), pattern="^broadcast_"))
+    return application
+
+async def poll_updates(application: Application, stop_event: asyncio.Event) -> None:
+    """Poll Telegram until stopped; in CLUSTER_MODE only the lease holder polls"""
+    if not CLUSTER_MODE:
+        await application.updater.start_polling()
+        startup.mark('receiving')
+        try:
+            await stop_event.wait()
+        finally:
+            await application.updater.stop()
+        return
+    
+    polling = False
+    try:
+        while not stop_event.is_set():
             try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=f"📣 Broadcast Message\n\n{message}"
-                )
-                success += 1
+                leader = await run_db(_acquire_lease, 'poller', WORKER_ID, LEASE_TTL)
             except Exception as e:
-                logger.error(f"Broadcast to {user['user_id']} failed: {e}")
-                failed += 1
+                logger.warning(f"Couldn't renew the polling lease: {e}")
+                leader = False
             
-            if idx % max(10, total//10) == 0 or idx == total:
-                percent = int((idx/total)*100)
-                try:
-                    await progress_msg.edit_text(
-                        f"📤 Broadcasting to {total} users...\n"
-                        f"{percent}% complete ({idx}/{total})\n"
-                        f"✅ Success: {success} ❌ Failed: {failed}"
-                    )
-                except:
-                    pass
+            if leader and not polling:
+                logger.info(f"Worker {WORKER_ID} acquired the polling lease")
+                await application.updater.start_polling()
+                startup.mark('receiving')
+                polling = True
+            elif not leader and polling:
+                logger.warning(f"Worker {WORKER_ID} lost the polling lease")
+                await application.updater.stop()
+                polling = False
             
-            time.sleep(0.1)
-        
-        await progress_msg.edit_text(
-            f"✅ Broadcast complete!\n"
-            f"• Total recipients: {total}\n"
-            f"• Successfully sent: {success}\n"
-            f"• Failed: {failed}"
-        )
-    except Exception as e:
-        logger.error(f"Error in broadcast_button: {e}")
-        await query.edit_message_text("⚠️ An error occurred during broadcast.")
+            try:
+                await asyncio.wait_for(stop_event.wait(), LEASE_TTL / 3)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if polling:
+            await application.updater.stop()
+            await run_db(_release_lease, 'poller', WORKER_ID)
+
+async def run_bot(application: Application, port: int = None, webhook_url: str = None,
+                  stop_event: asyncio.Event = None) -> None:
+    """Run the bot until SIGINT/SIGTERM or `stop_event`.
+    
+    Updates arrive by webhook when `webhook_url` is given (served together
+    with the health endpoints by WebhookServer on `port`), otherwise by
+    polling. Every process also works the shared job queue.
+    """
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    
+    server = None
+    await application.initialize()
+    startup.mark('initialize')
+    await post_init(application)
+    await application.start()
+    startup.mark('start')
+    try:
+        if webhook_url:
+            secret = webhook_secret(application.bot.token)
+            server = WebhookServer(application, WEBHOOK_PATH, secret)
+            await server.start('0.0.0.0', port)
+            await application.bot.set_webhook(
+                url=f"{webhook_url}{WEBHOOK_PATH}",
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=max(1, min(100, UPDATE_CONCURRENCY))
+            )
+            startup.mark('receiving')
+            logger.info("Telegram bot running in webhook mode")
+            await stop_event.wait()
+        else:
+            logger.info("Telegram bot running in polling mode")
+            await poll_updates(application, stop_event)
+    finally:
+        if server:
+            await server.stop()
+        # Stop background work while the bot can still talk to Telegram
+        await post_shutdown(application)
+        if application.running:
+            await application.stop()
+        await application.shutdown()
 
 def main() -> None:
+    setup_logging()
     # Use PORT from environment or default to 8080
     PORT = int(os.environ.get('PORT', 8080))
-    logger.info(f"Starting HTTP server on port {PORT}")
     
-    http_thread = threading.Thread(target=run_http_server, args=(PORT,), daemon=True)
-    http_thread.start()
-    logger.info(f"HTTP server thread started")
+    if not WEBHOOK_URL:
+        logger.info(f"Starting HTTP server on port {PORT}")
+        http_thread = threading.Thread(target=run_http_server, args=(PORT,), daemon=True)
+        http_thread.start()
+        logger.info(f"HTTP server thread started")
     
     TOKEN = os.getenv('TELEGRAM_TOKEN')
     if not TOKEN:
         logger.error("No TELEGRAM_TOKEN found in environment!")
         return
     
-    application = Application.builder().token(TOKEN).build()
+    # Indexes and stats seeding run in the background once the bot is up
+    application = build_application(TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL)
+    startup.mark('build_application')
     
-    # Command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("about", about_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("createquiz", create_quiz))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CommandHandler("add", add_command))
-    application.add_handler(CommandHandler("rem", rem_command))
-    application.add_handler(CommandHandler("upgrade", upgrade_command))
-    application.add_handler(CommandHandler("myplan", myplan_command))
-    application.add_handler(CommandHandler("plans", plans_command))
-    application.add_handler(CommandHandler("broadcast", broadcast_command))
-    application.add_handler(MessageHandler(filters.Document.TEXT, handle_document))
-    
-    # Callback handler
-    application.add_handler(CallbackQueryHandler(broadcast_button, pattern="^broadcast_"))
-    
-    logger.info("Starting Telegram bot in polling mode...")
-    application.run_polling()
+    if WEBHOOK_URL:
+        # One async server on PORT handles the webhook, health and metrics
+        asyncio.run(run_bot(application, PORT, WEBHOOK_URL))
+    else:
+        logger.info("Starting Telegram bot in polling mode...")
+        asyncio.run(run_bot(application))
+    db_executor.shutdown(wait=True)
+    log_writer.stop()
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] in (['backup'], ['restore']):
+        backup_cli(sys.argv[1:])
+    else:
+        main()